@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Time how long the package takes to import, the way each command would: report and merge only load the CLI, crawl
+loads the crawler on top of that. Every measurement is a fresh interpreter, and the figure reported is the median.
+With --against, the same measurements are made on another commit (checked out into a temporary git worktree) to
+show what changed.
+
+Usage:
+  bench_import.py [options]
+
+Options:
+  --runs <n>          Interpreters to start per measurement [default: 15].
+  --against <rev>     Also measure this commit, e.g. HEAD~1, and compare.
+  -o --output <file>  Write the results to this file as JSON too.
+"""
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from docopt import docopt
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# what each command imports before it gets going
+TARGETS = {
+    "package": "import creepycrawler",
+    "report mode": "import creepycrawler.cli",
+    "crawl mode": "import creepycrawler.cli, creepycrawler.crawler",
+    "library: LinkGraph": "from creepycrawler import LinkGraph",
+}
+# the import itself, timed from inside the interpreter so startup doesn't drown it out
+PROBE = "import time; t = time.perf_counter(); {code}; print(time.perf_counter() - t)"
+
+
+def import_ms(root, code, runs):
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE.format(code=code)], cwd=root, capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]) * 1000)
+    return round(statistics.median(times), 1)
+
+
+# the whole process, start to finish, for a command that stops straight after parsing its arguments
+def startup_ms(root, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(Path(root) / "creepy-crawler"), "--version"], cwd=root, capture_output=True, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 1)
+
+
+def measure(root, runs):
+    results = {name: import_ms(root, code, runs) for name, code in TARGETS.items()}
+    results["creepy-crawler --version"] = startup_ms(root, runs)
+    return results
+
+
+def git(*args):
+    return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+
+
+def main():
+    args = docopt(__doc__)
+    runs = int(args['--runs'])
+    results = {"commit": git("describe", "--always", "--dirty"), "python": sys.version.split()[0], "ms": measure(ROOT, runs)}
+
+    if args['--against']:
+        with tempfile.TemporaryDirectory() as tmp:
+            worktree = Path(tmp) / "old"
+            git("worktree", "add", "--detach", str(worktree), args['--against'])
+            try:
+                results["against"] = {"commit": git("rev-parse", "--short", args['--against']), "ms": measure(worktree, runs)}
+            finally:
+                git("worktree", "remove", "--force", str(worktree))
+
+    old = results.get("against", {}).get("ms", {})
+    header = f"{'median ms':<28}{results['commit']:>14}"
+    if old:
+        header += f"{results['against']['commit']:>14}   speedup"
+    print(header)
+    for name, ms in results["ms"].items():
+        line = f"{name:<28}{ms:>14}"
+        if name in old:
+            line += f"{old[name]:>14}   {old[name] / ms:.1f}x"
+        print(line)
+
+    if args['--output']:
+        with open(args['--output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args['--output']}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
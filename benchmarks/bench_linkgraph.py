@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Build a synthetic link graph the same way the crawler does, and report how long it took and how much memory it holds.
+With --against, the same graph is also built with another commit's LinkGraph (checked out into a temporary git
+worktree) and the two are compared.
+
+Usage:
+  bench_linkgraph.py [--pages <n>] [--links <n>] [--seed <n>] [--against <rev>] [--root <dir>]
+
+Options:
+  --pages <n>      Number of internal pages [default: 3500].
+  --links <n>      Links per page, like a nav-heavy site [default: 300].
+  --seed <n>       Random seed, so runs are comparable [default: 1].
+  --against <rev>  Also build the graph with this commit, e.g. the baseline, and compare.
+  --root <dir>     Checkout to import creepycrawler from. Defaults to this one.
+"""
+import gc
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from docopt import docopt
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def synthetic_links(pages, links, seed):
+    rng = random.Random(seed)
+    urls = [f"https://example.com/section{i % 50}/page{i}.html" for i in range(pages)]
+    # every page shares a nav bar, and links to a handful of external sites too
+    nav = rng.sample(urls, min(links // 2, pages))
+    for url in urls:
+        targets = nav + [rng.choice(urls) for _ in range(links - len(nav) - 10)]
+        targets += [f"https://elsewhere{rng.randrange(500)}.org/" for _ in range(10)]
+        yield url, targets
+
+
+def build(LinkGraph, pages, links, seed):
+    graph = LinkGraph()
+    graph.set_root("https://example.com/section0/page0.html")
+    for url, targets in synthetic_links(pages, links, seed):
+        node = graph.get_or_create_node(url, content_type="text/html", response_code=200, broken=False, external=False, file_path=url[19:])
+        for target in targets:
+            node.add_target(graph.get_or_create_node(target))
+    return graph
+
+
+def measure(root, pages, links, seed):
+    # run from a checkout without installing
+    sys.path.insert(0, str(root))
+    from creepycrawler.linkgraph import LinkGraph
+
+    gc.collect()
+    start = time.perf_counter()
+    graph = build(LinkGraph, pages, links, seed)
+    build_seconds = time.perf_counter() - start
+    edges = sum(len(node.links) for node in graph._crawled.values())
+    del graph
+
+    # memory is measured on a separate build, since tracing slows everything down
+    gc.collect()
+    tracemalloc.start()
+    graph = build(LinkGraph, pages, links, seed)
+    graph_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "pages": pages,
+        "links_per_page": links,
+        "nodes": len(graph._crawled),
+        "edges": edges,
+        "build_seconds": round(build_seconds, 3),
+        "graph_mb": round(graph_bytes / 1e6, 1),
+    }
+
+
+def git(*args):
+    return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+
+
+def main():
+    args = docopt(__doc__)
+    pages, links, seed = int(args['--pages']), int(args['--links']), int(args['--seed'])
+    results = measure(args['--root'] or ROOT, pages, links, seed)
+
+    if args['--against']:
+        results = {"commit": git("describe", "--always", "--dirty"), **results}
+        with tempfile.TemporaryDirectory() as tmp:
+            worktree = Path(tmp) / "old"
+            git("worktree", "add", "--detach", str(worktree), args['--against'])
+            try:
+                # a fresh interpreter, so the two versions of the package never share a process
+                out = subprocess.run([sys.executable, __file__, "--pages", str(pages), "--links", str(links), "--seed", str(seed),
+                                      "--root", str(worktree)], capture_output=True, text=True, check=True).stdout
+            finally:
+                git("worktree", "remove", "--force", str(worktree))
+        old = results["against"] = {"commit": git("rev-parse", "--short", args['--against']), **json.loads(out)}
+        results["speedup"] = round(old["build_seconds"] / results["build_seconds"], 1)
+        results["memory_ratio"] = round(results["graph_mb"] / old["graph_mb"], 2)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
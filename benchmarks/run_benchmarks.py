@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Crawl a synthetic site at a few sizes and time every stage: the crawl itself, saving and loading the graph in each
+format, the sitemap, the webroot inventory and comparison, and the reports. Results go to a JSON file (tagged with
+the current commit) so runs can be compared across commits with --compare.
+
+Each scale runs in a fresh process, so peak RSS means something. The site is served from this process.
+
+Usage:
+  run_benchmarks.py [options]
+  run_benchmarks.py --compare <old> <new>
+
+Options:
+  --scales <list>        Comma-separated: small, medium, large, or pages:links [default: small,medium].
+  --concurrency <n>      Requests in flight while crawling [default: 8].
+  --parse-workers <n>    Parser processes (0 parses on the fetching threads) [default: 0].
+  --slow-ms <ms>         How long the site's slow pages take [default: 50].
+  --seed <n>             Random seed for the site [default: 1].
+  -o --output <file>     Where to write the results [default: benchmark_results.json].
+"""
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from docopt import docopt
+
+# run from a checkout without installing
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from synthetic_site import SyntheticSite, serve
+
+SCALES = {
+    "small": (300, 20),
+    "medium": (3000, 40),
+    "large": (20000, 60),
+}
+GRAPH_FORMATS = ("json", "ndjson", "ccg")
+REPORT_FORMATS = ["json", "xml", "md"]
+
+
+def peak_rss_mb():
+    # kilobytes on linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1e6 if sys.platform == "darwin" else 1e3), 1)
+
+
+class Stages:
+    def __init__(self):
+        self.seconds = {}
+        self.rss = {}
+
+    @contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        yield
+        self.seconds[name] = round(time.perf_counter() - start, 3)
+        self.rss[name] = peak_rss_mb()
+
+
+# runs in its own process: everything the crawler and friends do, start to finish
+def run_scale(url, webroot, config, results):
+    from creepycrawler import Crawler, FileTree, LinkGraph, Reporting
+    from creepycrawler.helpers import Logger
+    Logger.set(silent=True, quiet=True)
+
+    stages = Stages()
+    out = {}
+    with stages.time("crawl"):
+        graph = Crawler(url, concurrency=config["concurrency"], parse_workers=config["parse_workers"]).run()
+    # every url we actually requested: pages, but also css, images, 404s and redirects
+    fetched = sum(1 for node in graph.nodes() if not node.external and node.response_code is not None)
+    out["nodes"] = len(graph._nodes)
+    out["urls_fetched"] = fetched
+    out["pages_per_second"] = round(fetched / stages.seconds["crawl"], 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        out["graph_bytes"] = {}
+        for fmt in GRAPH_FORMATS:
+            mode = "b" if fmt in LinkGraph.BINARY_FORMATS else ""
+            path = tmp / f"graph.{fmt}"
+            with stages.time(f"serialize_{fmt}"), open(path, "w" + mode) as f:
+                graph.dump(f, fmt)
+            out["graph_bytes"][fmt] = path.stat().st_size
+            with stages.time(f"deserialize_{fmt}"), open(path, "r" + mode) as f:
+                LinkGraph.read(f, fmt)
+
+        with stages.time("sitemap"):
+            graph.write_sitemap(tmp)
+        with stages.time("generate_sitemap"):
+            graph.generate_sitemap()
+
+        with stages.time("inventory"):
+            tree = FileTree(webroot)
+            tree.generate()
+        with stages.time("compare"):
+            tree.compare(graph)
+
+        with stages.time("reports"):
+            Reporting(graph, tree).write(["all"], REPORT_FORMATS, lambda name, mode: open(tmp / name, mode))
+
+    out["seconds"] = stages.seconds
+    out["peak_rss_mb_after"] = stages.rss
+    out["peak_rss_mb"] = peak_rss_mb()
+    results.put(out)
+
+
+def bench(name, pages, links, config):
+    site = SyntheticSite(pages=pages, links=links, slow_ms=config["slow_ms"], seed=config["seed"])
+    server, url = serve(site)
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    try:
+        with tempfile.TemporaryDirectory() as webroot:
+            site.write_webroot(webroot)
+            print(f"{name}: {pages} pages, {links} links each...", file=sys.stderr)
+            proc = ctx.Process(target=run_scale, args=(url, webroot, config, results))
+            proc.start()
+            out = results.get()
+            proc.join()
+    finally:
+        server.shutdown()
+    out = {"pages": pages, "links_per_page": links, **out}
+    print(f"  {out['pages_per_second']} pages/s, peak RSS {out['peak_rss_mb']} MB", file=sys.stderr)
+    return out
+
+
+def git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_file, new_file):
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    print(f"{old.get('commit') or old_file} -> {new.get('commit') or new_file}")
+    for scale, after in new["scales"].items():
+        before = old["scales"].get(scale)
+        if not before:
+            continue
+        print(f"\n{scale}:")
+        rows = [("pages/s", before["pages_per_second"], after["pages_per_second"]),
+                ("peak RSS MB", before["peak_rss_mb"], after["peak_rss_mb"])]
+        rows += [(f"{stage} s", before["seconds"].get(stage), seconds) for stage, seconds in after["seconds"].items()]
+        for label, a, b in rows:
+            change = f"{100 * (b - a) / a:+.1f}%" if a else ""
+            print(f"  {label:<24}{a if a is not None else '-':>10}{b:>10}  {change}")
+
+
+def main():
+    args = docopt(__doc__)
+    if args['--compare']:
+        compare(args['<old>'], args['<new>'])
+        return
+
+    config = {
+        "concurrency": int(args['--concurrency']),
+        "parse_workers": int(args['--parse-workers']),
+        "slow_ms": int(args['--slow-ms']),
+        "seed": int(args['--seed']),
+    }
+    scales = {}
+    for scale in args['--scales'].split(','):
+        scale = scale.strip()
+        if scale in SCALES:
+            pages, links = SCALES[scale]
+        else:
+            pages, links = map(int, scale.split(':'))
+        scales[scale] = bench(scale, pages, links, config)
+
+    results = {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "scales": scales,
+    }
+    with open(args['--output'], 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args['--output']}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Serve a made-up website for benchmarking the crawler. Everything is generated from the seed, so the same options
+always give the same site: pages linking to each other, css with url() references, redirects, 404s, some slow
+pages and some big binaries.
+
+Usage:
+  synthetic_site.py [options]
+
+Options:
+  --port <n>          Port to listen on [default: 8765].
+  --pages <n>         Number of html pages [default: 1000].
+  --links <n>         Links per page [default: 30].
+  --css <n>           Number of stylesheets, each full of url() references [default: 10].
+  --redirects <pct>   Percent of links that go through a redirect [default: 5].
+  --broken <pct>      Percent of links that 404 [default: 2].
+  --slow <pct>        Percent of pages that take a while to respond [default: 1].
+  --slow-ms <ms>      How long slow pages take [default: 200].
+  --binaries <n>      Number of big downloads linked from the site [default: 5].
+  --binary-kb <kb>    Size of each big download [default: 1024].
+  --seed <n>          Random seed [default: 1].
+"""
+import os
+import random
+import sys
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from docopt import docopt
+
+
+class SyntheticSite:
+    def __init__(self, pages=1000, links=30, css=10, redirects=5, broken=2, slow=1, slow_ms=200, binaries=5, binary_kb=1024, seed=1):
+        self.pages = pages
+        self.links = links
+        self.css = css
+        self.redirects = redirects
+        self.broken = broken
+        self.slow = slow
+        self.slow_ms = slow_ms
+        self.binaries = binaries
+        self.binary_kb = binary_kb
+        self.seed = seed
+        # the same bytes every time; 256 * 4 bytes to the kb
+        self._binary = bytes(range(256)) * (binary_kb * 4)
+
+    def _rng(self, *key):
+        return random.Random(f"{self.seed}/{'/'.join(map(str, key))}")
+
+    # path -> (status, content type, body, extra headers), or None for anything we don't know about
+    def respond(self, path):
+        path = path.split("?")[0]
+        if path == "/":
+            return self.respond("/p/0.html")
+        if path.startswith("/p/") and path.endswith(".html"):
+            i = path[3:-5]
+            if i.isdigit() and int(i) < self.pages:
+                return 200, "text/html; charset=utf-8", self.page(int(i)).encode(), {}
+        if path.startswith("/r/"):
+            return 301, "text/html", b"", {"Location": f"/p/{path[3:]}.html"}
+        if path.startswith("/css/") and path.endswith(".css"):
+            return 200, "text/css", self.stylesheet(path[5:-4]).encode(), {}
+        if path.startswith("/img/"):
+            return 200, "image/png", b"\x89PNG\r\n\x1a\n" + bytes(64), {}
+        if path.startswith("/bin/"):
+            return 200, "application/octet-stream", self._binary, {}
+        return None
+
+    def is_slow(self, path):
+        return path.startswith("/p/") and self._rng("slow", path).random() * 100 < self.slow
+
+    def page(self, i):
+        rng = self._rng("page", i)
+        links = [f"/p/{(i + 1) % self.pages}.html"]
+        for _ in range(self.links - 1):
+            roll = rng.random() * 100
+            target = rng.randrange(self.pages)
+            if roll < self.broken:
+                links.append(f"/missing/{target}.html")
+            elif roll < self.broken + self.redirects:
+                links.append(f"/r/{target}")
+            else:
+                links.append(f"/p/{target}.html")
+        if self.binaries and i % 50 == 0:
+            links.append(f"/bin/{rng.randrange(self.binaries)}.bin")
+        body = "\n".join(f'<li><a href="{url}">link {n}</a></li>' for n, url in enumerate(links))
+        style = f'<link rel="stylesheet" href="/css/{i % self.css}.css">' if self.css else ""
+        return (f"<!doctype html><html><head><title>Page {i}</title>{style}</head>"
+                f"<body><h1>Page {i}</h1><ul>\n{body}\n</ul>{'<p>filler text</p>' * 20}</body></html>")
+
+    def stylesheet(self, name):
+        rng = self._rng("css", name)
+        return "\n".join(f".c{n} {{ background: url('/img/{rng.randrange(200)}.png'); }}" for n in range(20))
+
+    # what the webroot behind this site would look like, for FileTree.compare. includes a few orphans
+    def files(self):
+        yield from (f"/p/{i}.html" for i in range(self.pages))
+        yield from (f"/css/{i}.css" for i in range(self.css))
+        yield from (f"/img/{i}.png" for i in range(200))
+        yield from (f"/bin/{i}.bin" for i in range(self.binaries))
+        yield from (f"/old/orphan{i}.html" for i in range(max(1, self.pages // 100)))
+
+    def write_webroot(self, directory):
+        for path in self.files():
+            target = os.path.join(directory, path.lstrip("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "w") as f:
+                f.write(path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, site, *args, **kwargs):
+        self.site = site
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._respond(body=True)
+
+    def do_HEAD(self):
+        self._respond(body=False)
+
+    def _respond(self, body):
+        if self.path == "/robots.txt":
+            result = None
+        else:
+            result = self.site.respond(self.path)
+        if self.site.is_slow(self.path):
+            time.sleep(self.site.slow_ms / 1000)
+        status, content_type, content, headers = result or (404, "text/html", b"<h1>Not found</h1>", {})
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        if body:
+            self.wfile.write(content)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the crawler hangs up on downloads it doesn't want, which is business as usual
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+# start serving in the background; returns (server, base url). call server.shutdown() when done
+def serve(site, port=0):
+    server = _Server(("127.0.0.1", port), partial(_Handler, site))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def main():
+    args = docopt(__doc__)
+    site = SyntheticSite(
+        pages=int(args['--pages']), links=int(args['--links']), css=int(args['--css']),
+        redirects=float(args['--redirects']), broken=float(args['--broken']), slow=float(args['--slow']),
+        slow_ms=int(args['--slow-ms']), binaries=int(args['--binaries']), binary_kb=int(args['--binary-kb']),
+        seed=int(args['--seed']),
+    )
+    server, url = serve(site, int(args['--port']))
+    print(f"Serving a {site.pages} page site on {url} (ctrl-c to stop)", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,26 @@
-from .crawler import Crawler
-from .dirtree import FileTree
-from .linkgraph import LinkGraph
-from .reporting import Reporting
-from .cli import CLI
+import importlib
+
+# everything here is loaded on first use rather than up front: the crawler pulls in requests and BeautifulSoup,
+# which report mode (and anyone who just wants to read a link graph) never needs
+_EXPORTS = {
+    'Crawler': '.crawler',
+    'FileTree': '.dirtree',
+    'LinkGraph': '.linkgraph',
+    'Reporting': '.reporting',
+    'CLI': '.cli',
+}
 __all__ = ['Crawler', 'FileTree', 'LinkGraph', 'Reporting', 'CLI']
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    # so we only come through here once per name
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import requests
+from .helpers import Logger, JsonCache
+from .scheduler import TokenBucket
+
+# the Wayback Machine's availability API. anything that answers ?url=... the same way will do (e.g. a local stand-in for testing)
+WAYBACK_ENDPOINT = "https://archive.org/wayback/available"
+
+
+class SnapshotCache(JsonCache):
+    """
+    Remembers the archived copy (or lack of one) we found for each url, so a site with thousands of rotten links
+    doesn't ask the archive about every one of them on every run. Urls with no snapshot are retried sooner (after
+    miss_ttl rather than ttl seconds), since one may have turned up in the meantime.
+    """
+    DESCRIPTION = "snapshot cache"
+
+    def __init__(self, path, ttl=30 * 86400, miss_ttl=86400):
+        super().__init__(path, ttl)
+        self.miss_ttl = miss_ttl
+
+    # returns (found, snapshot). snapshot can be None when we know there isn't one
+    def get(self, url):
+        entry = super().get(url)
+        return (True, entry["snapshot"]) if entry else (False, None)
+
+    def put(self, url, snapshot):
+        super().put(url, snapshot=snapshot)
+
+    def ttl_for(self, entry):
+        return self.ttl if entry["snapshot"] else self.miss_ttl
+
+
+class ArchiveLookup:
+    """
+    Finds the most recent archived copy of every broken link in a graph and stores it on the node (node.archive).
+    Lookups go out concurrency at a time, but never faster than rate per second in total - the archive is a shared
+    resource and will start refusing us if we hammer it. Anything we fail to reach isn't cached, so it gets another go next run.
+    """
+    def __init__(self, session, endpoint=WAYBACK_ENDPOINT, concurrency=8, rate=5, cache=None):
+        self.session = session
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst=concurrency)
+        self.cache = cache
+
+    def annotate(self, graph):
+        nodes = [node for node in graph.nodes() if node.broken]
+        todo = []
+        for node in nodes:
+            found, snapshot = self.cache.get(node.url) if self.cache else (False, None)
+            if found:
+                self._record(graph, node, snapshot)
+            else:
+                todo.append(node)
+        Logger.print(1, f"Looking up {len(todo)} dead links on the Internet Archive ({len(nodes) - len(todo)} cached)")
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = pool.map(lambda node: self._snapshot(node.url), todo)
+            for node, (ok, snapshot) in zip(todo, results):
+                self._record(graph, node, snapshot)
+                if ok and self.cache:
+                    self.cache.put(node.url, snapshot)
+
+        if self.cache:
+            self.cache.save()
+        archived = sum(1 for node in nodes if node.archive)
+        Logger.print(1, f"{archived} of {len(nodes)} dead links have an archived copy")
+
+    def _record(self, graph, node, snapshot):
+        graph.get_or_create_node(node.url, archive=snapshot)
+        if snapshot:
+            Logger.print(2, f"Archived copy of {node.url}: {snapshot}")
+
+    # runs on a worker thread. returns (whether we got an answer, snapshot url or None)
+    def _snapshot(self, url):
+        self.bucket.take()
+        try:
+            response = self.session.get(f"{self.endpoint}?{urlencode({'url': url})}")
+            if response.status_code != 200:
+                Logger.print(2, f"Archive lookup for {url} got {response.status_code}")
+                return False, None
+            closest = response.json().get("archived_snapshots", {}).get("closest") or {}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            Logger.print(2, f"Archive lookup failed for {url}: {e}")
+            return False, None
+        if closest.get("available") and closest.get("url"):
+            return True, closest["url"]
+        return True, None
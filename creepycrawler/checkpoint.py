@@ -0,0 +1,73 @@
+import json
+import os
+import time
+from pathlib import Path
+from .helpers import Logger
+
+
+class Checkpoint:
+    """
+    Append-only journal of every page the crawler has finished with, one JSON object per line.
+    The queue, the visited set and the graph are all deterministic functions of these records, so instead of
+    dumping them wholesale (which would stall the crawl on a big site) we only ever append the newest page,
+    and on --resume the crawler replays the journal to rebuild everything without touching the network.
+    """
+    def __init__(self, path, flush_every=100, flush_seconds=10):
+        self.path = Path(path)
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._file = None
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    # read back whatever made it to disk last time, keyed by the url the crawler asked for
+    def load(self):
+        pages = {}
+        if not self.path.exists():
+            return pages
+        good_bytes = 0
+        unterminated = False
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    page = json.loads(line)
+                except ValueError:
+                    # we probably died halfway through writing this one, so everything after it is junk
+                    break
+                pages[page["requested"]] = page
+                good_bytes += len(line)
+                # a whole record whose newline never made it out (record() writes them separately)
+                unterminated = not line.endswith(b"\n")
+        # chop off any half-written line so the next append starts clean
+        if good_bytes != self.path.stat().st_size:
+            Logger.print(1, f"Discarding a partial record at the end of {self.path}")
+            os.truncate(self.path, good_bytes)
+        # otherwise the next append would be glued onto the end of the last record
+        if unterminated:
+            with open(self.path, 'ab') as f:
+                f.write(b"\n")
+        Logger.print(1, f"Loaded {len(pages)} pages from checkpoint {self.path}")
+        return pages
+
+    # resume=False starts a fresh journal, clobbering any old one
+    def open(self, resume=False):
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+
+    def record(self, page):
+        self._file.write(json.dumps(page))
+        self._file.write("\n")
+        self._pending += 1
+        # flushing is what actually makes it a checkpoint, but doing it for every page would be a waste
+        if self._pending >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
@@ -16,6 +16,7 @@ Usage:
   creepy-crawler crawl [options] <website> [<webroot>] [--working-dir <directory>] 
   creepy-crawler report [options] <webroot> --link-graph <file> 
                                                     [--working-dir <directory>]
+  creepy-crawler merge [options] <shard>... [--working-dir <directory>]
   creepy-crawler (-h | --help)
   creepy-crawler (-v | --version)
 
@@ -23,6 +24,8 @@ Commands:
   crawl                         Crawl a live website and generate a link graph.
   report                        Generate reports using a pre-existing link 
                                 graph and a local directory.
+  merge                         Combine the link graph shards from the workers
+                                of a distributed crawl (see --redis) into one.
 
 Arguments:
     <website>                   The URL of the website you are trying to crawl.
@@ -30,31 +33,119 @@ Arguments:
                                 Supports remote path using scp syntax
                                         [user@]server:path/
                                  An SSH session will be establised.
+    <shard>                     A link graph saved by one worker of a
+                                distributed crawl.
 
 Options:
   -a --archive-dead-links       If dead links are found, look for the 
                                 most recent copy on the Internet Archive.
+  --archive-endpoint <url>      Where to ask about archived copies. Defaults
+                                to the Wayback Machine's availability API.
+  --crawl-id <name>             Which distributed crawl to join; every worker
+                                given the same name shares one. Defaults to
+                                the website's domain.
+  -c --concurrency <n>          Number of requests to keep in flight at once
+                                while crawling. Defaults to 1.
+  --dedup-content               Fingerprint every page, and record pages with
+                                the same or nearly the same text as one found
+                                earlier as aliases of it. Links on exact
+                                copies aren't followed.
+  -e --check-external          Check whether external links still work, and
+                                count dead ones as broken links.
+  --check-workers <n>           How many external links to check at once
+                                (at most 2 per host). Defaults to 16.
+  --external-ttl <hours>        How long a checked external link is trusted
+                                before being checked again. Defaults to 24.
   -f --format <fmt>             Output format(s) for the report(s) (comma-
                                 separated): 
-                                    json, xml, md 
-                                The default is json.
+                                    json, ndjson, ccg, ccgz, xml, md 
+                                The link graph is saved as json, ndjson
+                                (one node per line, lighter on memory for
+                                big sites) and/or ccg (compact binary that
+                                report mode reads without loading it all;
+                                ccgz is the zstd-compressed version). The
+                                default is json.
+  --frontier <kind>             Where to keep the queue of pages still to
+                                crawl: memory, or disk for sites too big to
+                                fit in RAM. Defaults to memory. Can't be
+                                used with --redis.
   -h --help                     Show this help message.
+  --hash-files                  Hash the contents of every file in the
+                                webroot, so reports can show which files
+                                changed since the last run.
+  --http2                       Use HTTP/2 where the server supports it.
+                                Requires httpx[http2].
   -i --ignore <regex>           Any files matching the specified regex will be
                                 excluded from the local tree. Defaults to 
                                 ^\\..* (i.e., any file beginning with a .)
+  --ignore-robots               Crawl pages even if robots.txt disallows them.
+  -I --incremental <file>       Re-crawl against the link graph from a previous
+                                crawl, only re-downloading pages the server
+                                says have changed.
   -l --link-graph <file>        In crawl mode, link graph will be saved to this
                                 file. In report mode, graph will be read from 
                                 this file. If not specified, will try working
                                 directory.
+  -W --parse-workers <n>        Number of separate processes to parse pages in.
+                                Only useful with --concurrency; by default
+                                pages are parsed on the fetching threads.
+  --max-depth <n>               Don't crawl urls more than n directories deep.
+  --max-repeats <n>             Don't crawl urls where any one directory name
+                                appears more than n times (e.g. /a/b/a/b/a/b/,
+                                from relative links that nest forever).
+  --metrics <file>              Append crawl metrics (pages per second, status
+                                codes, fetch and parse latency, queue depth)
+                                to this file as JSON lines while crawling.
+  --metrics-interval <s>        Seconds between metrics updates. Defaults to 5.
+  -m --max-body-size <bytes>    Stop downloading an HTML or CSS file after this
+                                many bytes. Other file types are never
+                                downloaded past the headers. Defaults to
+                                10000000.
+  -P --parser <name>            HTML parser to pull links out of pages with:
+                                html.parser, or lxml (faster, needs lxml).
+                                Defaults to html.parser.
+  --pattern-budget <n>          Crawl at most n urls of any one shape, where
+                                numbers match any number and query values are
+                                ignored (e.g. calendars: /events/2024/05?day=1).
+  --progress                    Show a live progress line while crawling.
+  --prometheus <file>           Keep crawl metrics in this file in Prometheus
+                                text format (e.g. for node_exporter).
+  -p --pool-size <n>            Number of keep-alive connections to hold open
+                                per host. Defaults to the concurrency.
   -w --working-dir <directory>  Set the working directory to read from or output 
                                 to. Defaults to ./<website>.
   -q --quiet                    Show only abnormalities, like broken links.
+  --redis <url>                 Crawl together with other workers (on this
+                                machine or others) through this Redis server,
+                                e.g. redis://localhost:6379/0. Each worker
+                                saves its share of the link graph as a shard
+                                (<graph>.<worker>.<fmt>); combine them with
+                                merge, then run reports on the result.
+                                Workers keep no checkpoint.
   -r --report-types <types>     Comma-separated: 
                                     deadlinks, unreachable, combined, all
+                                deadlinks lists broken links (and who links
+                                to them) and redirects; unreachable lists
+                                pages and webroot files nothing reachable
+                                links to; combined is both in one file; all
+                                writes each of them.
                                 Defaults to all in report mode, otherwise none.
+  --rate-limit <n>              Most requests per second to send to any one
+                                host. Defaults to no limit, other than what
+                                robots.txt and the server's responses ask for.
+  -R --resume                   Pick an interrupted crawl back up from the
+                                checkpoint in the working directory.
   -s --silent                   Don't show any output.
+  --sort-params                 Put query parameters in order, so ?a=1&b=2 and
+                                ?b=2&a=1 are the same page.
+  --strip-params <regex>        Drop query (and ;path) parameters whose names
+                                match from every url, e.g. session ids and
+                                tracking tags: '^(sid|jsessionid|utm_.*)$'
   -v --version                  Show version.
   -x --sitemap-xml              Generate a standards-compliant XML sitemap.
+                                Big sites are split into sitemap-N.xml files
+                                listed in a sitemap.xml index.
+  -z --gzip-sitemap             Gzip the sitemap files (sitemap.xml.gz).
 
 """
 from docopt import docopt
@@ -64,14 +155,21 @@ import re
 import os
 from pathlib import Path
 from urllib.parse import urlparse
-from creepycrawler import Crawler, FileTree, LinkGraph, Reporting
+# only what every command needs is imported up here. the crawler and its friends (requests, BeautifulSoup, redis)
+# are imported once we know we're crawling, so report and merge start without waiting on them
+from .linkgraph import LinkGraph
+from .graphfile import MappedGraph
+from .dirtree import FileTree, InventoryCache
+from .reporting import Reporting
+from .metrics import Metrics, ProgressSink, JsonLinesSink, PrometheusSink
 # make helper functions available as needed
 from .helpers import *
 
 # ensure the actual executable path is displayed in help message
 class CLI:
-    __valid_formats = {'json','xml', 'md'}
+    __valid_formats = {'json', 'ndjson', 'ccg', 'ccgz', 'xml', 'md'}
     __valid_report_types = {'deadlinks', 'unreachable', 'combined', 'all'}
+    __valid_frontiers = {'memory', 'disk'}
     def __init__(self):
         # load config settings from command line arguments, using docopt for initial parsing
         self.args = docopt(__doc__, version='0.1')
@@ -83,8 +181,67 @@ class CLI:
         self.quiet = self.args['--quiet']
         self.silent = self.args['--silent']
         self.archive_dead_links = self.args['--archive-dead-links']
+        self.archive_endpoint = self.args['--archive-endpoint']
         self.generate_sitemap = self.args['--sitemap-xml']
+        self.hash_files = self.args['--hash-files']
+        self.gzip_sitemap = self.args['--gzip-sitemap']
         self.ignore_regex = self.args['--ignore'] or r'^\..*'
+        self.concurrency = self._positive_int('--concurrency', 1)
+        self.pool_size = self._positive_int('--pool-size', self.concurrency)
+        self.parse_workers = self._positive_int('--parse-workers', 0)
+        self.max_body_size = self._positive_int('--max-body-size', 10_000_000)
+        self.check_external = self.args['--check-external']
+        self.external_ttl = self._positive_int('--external-ttl', 24)
+        self.check_workers = self._positive_int('--check-workers', 16)
+        self.rate_limit = self._positive_int('--rate-limit', None)
+        self.respect_robots = not self.args['--ignore-robots']
+        self.dedup_content = self.args['--dedup-content']
+        self.strip_params = self.args['--strip-params']
+        self.sort_params = self.args['--sort-params']
+        if self.strip_params:
+            try:
+                re.compile(self.strip_params)
+            except re.error as e:
+                Logger.eprint(f"Error: --strip-params isn't a valid regex: {e}")
+                sys.exit(1)
+        self.max_depth = self._positive_int('--max-depth', None)
+        self.max_repeats = self._positive_int('--max-repeats', None)
+        self.pattern_budget = self._positive_int('--pattern-budget', None)
+        self.progress = self.args['--progress']
+        self.metrics_file = self.args['--metrics']
+        self.prometheus_file = self.args['--prometheus']
+        self.metrics_interval = self._positive_int('--metrics-interval', 5)
+        self.http2 = self.args['--http2']
+        self.frontier_kind = self.args['--frontier'] or 'memory'
+        if self.frontier_kind not in self.__valid_frontiers:
+            Logger.eprint(f"Error: unknown frontier {self.frontier_kind}.")
+            sys.exit(1)
+        self.redis_url = self.args['--redis']
+        self.crawl_id = self.args['--crawl-id'] or self.domain
+        if self.redis_url:
+            try:
+                import redis
+            except ImportError:
+                Logger.eprint("Error: --redis needs redis installed (pip install redis).")
+                sys.exit(1)
+        if self.redis_url and self.args['--resume']:
+            # the shared queue carries on by itself when workers come back; there's nothing for --resume to replay into
+            Logger.eprint("Error: --resume can't be used with --redis. Just start the workers again.")
+            sys.exit(1)
+        if self.redis_url and self.args['--frontier']:
+            # the queue lives in redis, so there's no local frontier for this to choose
+            Logger.eprint("Error: --frontier can't be used with --redis, which keeps the queue in redis.")
+            sys.exit(1)
+        self.parser = self.args['--parser'] or 'html.parser'
+        if self.crawl_mode:
+            from . import parsing
+            if self.parser not in parsing.PARSERS:
+                Logger.eprint(f"Error: unknown parser {self.parser}.")
+                sys.exit(1)
+            if self.parser == 'lxml' and parsing.etree is None:
+                Logger.eprint("Error: --parser lxml needs lxml installed (pip install lxml).")
+                sys.exit(1)
+        self.previous_graph_file = valid_path(self.args['--incremental'], dir=False, mode="r", fatal=True) if self.args['--incremental'] else None
         
         # set up logger for verbosity levels
         Logger.set(silent=self.args['--silent'], quiet=self.args['--quiet'])
@@ -115,15 +272,20 @@ class CLI:
         # in crawl mode we need to know two things:
         # 1. can we write to the link graph file?
         # 2. if there are reports, can we write to those?
-        # TODO: add continue functionality
+        # the working directory always gets used, since that's where the crawl checkpoint lives
         if self.crawl_mode:
             # check if we can write to the absolute path of the link graph file. if not, we will need to use the working directory.
             lgf = valid_path(lg_rough, dir=False, mode="r")
-            # if we need to use the working directory, check that we can do so (or create it)
-            if self.report_types or self.generate_sitemap or not lgf:
-                wd = valid_path(wd_rough, dir=True, mode="w", fatal=True)
+            # check that we can use the working directory (or create it)
+            wd = valid_path(wd_rough, dir=True, mode="w", fatal=True)
+            self.checkpoint_file = (wd / f"{self.domain}_checkpoint.ndjson").resolve()
             # if we didn't find a valid lgf to write to before, try within the wd
             self.link_graph_file = (lgf or valid_path(wd / lg_rough, dir=False, mode="w", fatal=True)).resolve()
+        elif self.args['merge']:
+            self.shard_files = [valid_path(shard, dir=False, mode="r", fatal=True).resolve() for shard in self.args['<shard>']]
+            self.working_dir = valid_path(wd_rough, dir=True, mode="w", fatal=True)
+            # without --link-graph, the merged graph is named after the site once we know which site it is
+            self.link_graph_file = Path(self.args['--link-graph']).resolve() if self.args['--link-graph'] else None
         else:
             # in report mode, we need to READ the lgf and write to the working directory
             lgf = valid_path(lg_rough, dir=False, mode="r")
@@ -132,7 +294,7 @@ class CLI:
             wd = valid_path(wd_rough, dir=True, mode=("rw" if lgf else "w"), fatal=True)
             self.working_dir = wd
             # now, ensure we have a valid lgf to read - either from before or inside the wd
-            self.link_graph_file = (lgf or valid_path(wd / lg_rough, dir=False, mode="r") or valid_path(wd / f"{self.domain}_graph.md", dir=False, mode="r") or valid_path(wd / f"{self.domain}_graph.json", dir=False, mode="r", fatal=True)).resolve()
+            self.link_graph_file = (lgf or valid_path(wd / lg_rough, dir=False, mode="r") or valid_path(wd / f"{self.domain}_graph.md", dir=False, mode="r") or valid_path(wd / f"{self.domain}_graph.ndjson", dir=False, mode="r") or valid_path(wd / f"{self.domain}_graph.ccg", dir=False, mode="r") or valid_path(wd / f"{self.domain}_graph.json", dir=False, mode="r", fatal=True)).resolve()
         
         Logger.print(2,f"Set working directory to {self.working_dir}")
         # finally, tell the file helper where our WD is
@@ -140,28 +302,115 @@ class CLI:
 
         
 
+    # numeric options come in as strings (or None if they weren't given)
+    def _positive_int(self, option, default):
+        raw = self.args[option]
+        if raw is None:
+            return default
+        try:
+            value = int(raw)
+            assert value > 0
+        except (ValueError, AssertionError):
+            Logger.eprint(f"Error: {option} must be a positive whole number, not {raw}.")
+            sys.exit(1)
+        return value
+
     def run(self):
         webroot = self.args['<webroot>']
         if self.args['crawl']:
+            from .crawler import Crawler
+            from .frontier import MemoryFrontier, DiskFrontier, RedisFrontier
+            from .linkcheck import LinkCache
+            from .archive import SnapshotCache, WAYBACK_ENDPOINT
             Logger.print(1,f"Starting crawl on: {self.website}")
+            previous = None
+            if self.previous_graph_file:
+                Logger.print(2,f"Loading previous link graph from: {self.previous_graph_file}")
+                fmt = LinkGraph.format_of(self.previous_graph_file)
+                with RWTool.open(self.previous_graph_file, 'rb' if fmt in LinkGraph.BINARY_FORMATS else 'r') as f:
+                    previous = LinkGraph.load(f, fmt)
+            if self.redis_url:
+                import redis
+                try:
+                    frontier = RedisFrontier.connect(self.redis_url, self.crawl_id)
+                except redis.exceptions.RedisError as e:
+                    Logger.eprint(f"Error: couldn't reach {self.redis_url}: {e}")
+                    sys.exit(1)
+                Logger.print(1, f"Joining crawl {self.crawl_id} as worker {frontier.worker}")
+            elif self.frontier_kind == 'disk':
+                frontier = DiskFrontier(self.working_dir / f"{self.domain}_frontier.sqlite")
+            else:
+                frontier = MemoryFrontier()
+            archive_cache = SnapshotCache(self.working_dir / "archive_snapshots.json") if self.archive_dead_links else None
+            link_cache = LinkCache(self.working_dir / "external_links.json", ttl=self.external_ttl * 3600) if self.check_external else None
             crawler = Crawler(
                 self.website,
                 ignore=self.ignore_regex,
-                archive_dead=self.archive_dead_links
+                archive_dead=self.archive_dead_links,
+                archive_endpoint=self.archive_endpoint or WAYBACK_ENDPOINT,
+                archive_cache=archive_cache,
+                concurrency=self.concurrency,
+                pool_size=self.pool_size,
+                http2=self.http2,
+                previous=previous,
+                # with --redis there's nothing to resume from a checkpoint, and every worker would write the same file
+                checkpoint=None if self.redis_url else self.checkpoint_file,
+                resume=self.args['--resume'],
+                frontier=frontier,
+                parser=self.parser,
+                parse_workers=self.parse_workers,
+                max_body_size=self.max_body_size,
+                check_external=self.check_external,
+                check_workers=self.check_workers,
+                link_cache=link_cache,
+                rate_limit=self.rate_limit,
+                respect_robots=self.respect_robots,
+                metrics=self._metrics(),
+                dedup_content=self.dedup_content,
+                strip_params=self.strip_params,
+                sort_params=self.sort_params,
+                max_depth=self.max_depth,
+                max_repeats=self.max_repeats,
+                pattern_budget=self.pattern_budget
             )
-            # run the crawler and save the resulting graph to a file
-            link_graph = crawler.run()
+            if self.redis_url:
+                # one worker's graph is only part of the site, so the sitemap and reports wait for the merge
+                link_graph = crawler.run()
+                shard = self.link_graph_file.with_name(f"{self.link_graph_file.stem}.{frontier.worker}{self.link_graph_file.suffix}")
+                Logger.print(1, f"Crawl complete! Saving this worker's shard...")
+                # a shard that can't be merged is no use to anyone
+                self._save_graph(link_graph, shard, [fmt for fmt in self.serial_formats if fmt in LinkGraph.FORMATS] or ["json"])
+                Logger.print(1, "Combine the shards from every worker with: creepy-crawler merge <shard>...")
+            else:
+                # take inventory of the webroot while the crawl runs, rather than after it
+                file_tree = self._start_inventory(webroot)
 
-            Logger.print(1, f"Crawl complete! Saving serialized output...")
+                # run the crawler and save the resulting graph to a file
+                link_graph = crawler.run()
 
-            # serialize to all requested formats and save
-            for fmt in self.serial_formats:
-                Logger.print(2,f"Serializing to to {fmt}...")
-                serialized = link_graph.serialize(fmt)
-                with RWTool.open(self.link_graph_file.with_suffix(f".{fmt}"),'w') as f:
-                    f.write(serialized)
+                Logger.print(1, f"Crawl complete! Saving serialized output...")
+                self._save_graph(link_graph, self.link_graph_file, self.serial_formats)
+                # the graph is safely on disk, so the journal has nothing left to offer (and --resume shouldn't replay a finished crawl)
+                self.checkpoint_file.unlink(missing_ok=True)
+                self._process_graph(link_graph, file_tree)
 
-            self._process_graph(link_graph, webroot)
+        elif self.args['merge']:
+            link_graph = LinkGraph()
+            for shard in self.shard_files:
+                Logger.print(2, f"Merging in {shard}")
+                fmt = LinkGraph.format_of(shard)
+                if fmt in LinkGraph.BINARY_FORMATS:
+                    link_graph.merge(MappedGraph.open(shard))
+                else:
+                    with RWTool.open(shard, 'r') as f:
+                        link_graph.merge(LinkGraph.load(f, fmt))
+            Logger.print(1, f"Merged {len(self.shard_files)} shards into {len(link_graph._nodes)} urls")
+            if not link_graph.root:
+                Logger.eprint("Error: none of the shards have anything in them.")
+                sys.exit(1)
+            graph_file = self.link_graph_file or self.working_dir / f"{urlparse(link_graph.root.url).netloc}_graph.xml"
+            self._save_graph(link_graph, graph_file, self.serial_formats)
+            self._process_graph(link_graph, None)
 
         elif self.args['report']:
             webroot = self.args['<webroot>']
@@ -170,13 +419,16 @@ class CLI:
                 sys.exit(1)
 
             Logger.print(2,f"Loading link graph from: {self.link_graph_file}")
-            with RWTool.open(self.link_graph_file, 'r') as f:
-                lg_str = f.readlines()
-
-            link_graph = LinkGraph.load(lg_str)
+            fmt = LinkGraph.format_of(self.link_graph_file)
+            if fmt in LinkGraph.BINARY_FORMATS:
+                # no need to build the whole graph; reports just look things up in the file
+                link_graph = MappedGraph.open(self.link_graph_file)
+            else:
+                with RWTool.open(self.link_graph_file, 'r') as f:
+                    link_graph = LinkGraph.load(f, fmt)
 
             # now we've loaded the graph, let's process it
-            self._process_graph(link_graph, webroot)
+            self._process_graph(link_graph, self._start_inventory(webroot))
 
         else:
             Logger.eprint("Invalid command. Use --help to see available options.")
@@ -185,30 +437,55 @@ class CLI:
         Logger.print(1, "All done!")
 
 
-    def _process_graph(self, link_graph, webroot):
+    # serialize to all requested formats the graph can be saved in, straight to disk
+    def _save_graph(self, link_graph, path, formats):
+        for fmt in formats:
+            if fmt not in LinkGraph.FORMATS:
+                continue
+            Logger.print(2,f"Serializing to {fmt}...")
+            with RWTool.open(path.with_suffix(f".{fmt}"), 'wb' if fmt in LinkGraph.BINARY_FORMATS else 'w') as f:
+                link_graph.dump(f, fmt)
+
+    # nothing gets measured unless something is going to show it
+    def _metrics(self):
+        sinks = []
+        if self.progress and not self.silent:
+            sinks.append(ProgressSink())
+        if self.metrics_file:
+            sinks.append(JsonLinesSink(self.working_dir / self.metrics_file))
+        if self.prometheus_file:
+            sinks.append(PrometheusSink(self.working_dir / self.prometheus_file))
+        return Metrics(sinks, interval=self.metrics_interval) if sinks else None
+
+    def _start_inventory(self, webroot):
+        if not webroot:
+            return None
+        Logger.print(1,"Now generating the webroot file tree...")
+        # remembers what the webroot looked like last time, so only directories that changed get listed again
+        cache = InventoryCache(self.working_dir / "inventory.json")
+        file_tree = FileTree(webroot, ignore=self.ignore_regex, cache=cache, hash_files=self.hash_files)
+        file_tree.start()
+        return file_tree
+
+    def _process_graph(self, link_graph, file_tree):
         if self.generate_sitemap:
             Logger.print(1,"Generating site map!")
-            with RWTool.open("sitemap.xml", "w") as f:
-                f.write(link_graph.generate_sitemap())
+            link_graph.write_sitemap(self.working_dir, compress=self.gzip_sitemap)
         
-        # store directory tree here to be compared in the report generator
-        file_tree = None
-        if webroot:
-            # initialize the file tree and build is
-            Logger.print(1,"Now generating the webroot file tree...")
-            file_tree = FileTree(webroot, ignore=self.ignore_regex)
-            file_tree.generate()
+        # the directory tree gets compared in the report generator, so it has to be finished by now
+        if file_tree:
+            file_tree.wait()
             Logger.print(1,"Done!")
                 
-        # generate all the requisite reports and write them to their respective files
-        for rtype in self.report_types:
-            Logger.print(1,f"Generating {rtype} report(s)...")
-            for fmt in self.serial_formats:
-                r = Reporting.generate(link_graph, file_tree, rtype, fmt)
-                with RWTool.open(f"{rtype}.{fmt}", "w") as f:
-                    f.write(r)
+        # generate all the requisite reports and write them to their respective files, in one go.
+        # (binary is only for link graphs)
+        formats = [fmt for fmt in self.serial_formats if fmt not in LinkGraph.BINARY_FORMATS]
+        if self.report_types and formats:
+            Logger.print(1,f"Generating {', '.join(self.report_types)} report(s)...")
+            Reporting(link_graph, file_tree).write(self.report_types, formats, RWTool.open)
 
 def signal_handler(sig, frame):
-    Logger.eprint("CTRL-C detected; quitting.")
+    # exiting unwinds the crawl loop, which flushes the checkpoint on its way out
+    Logger.eprint("CTRL-C detected; quitting. Crawls can be picked back up with --resume.")
     sys.exit(1);
 signal.signal(signal.SIGINT, signal_handler)
@@ -1,85 +1,342 @@
+import multiprocessing
 import re
+import signal
+import time
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse, urldefrag
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from threading import BoundedSemaphore
+from urllib.parse import urlparse, urldefrag
 from creepycrawler.linkgraph import LinkGraph
 from .helpers import Logger
+from .session import Session
+from .checkpoint import Checkpoint
+from .frontier import MemoryFrontier
+from .parsing import parse_document, normalize_url
+from .linkcheck import LinkChecker
+from .archive import ArchiveLookup, WAYBACK_ENDPOINT
+from .scheduler import HostScheduler
+from .fingerprint import ContentIndex, parse_fingerprinted
+from .urlrules import UrlCanonicalizer, TrapGuard
 
 
 class Crawler:
-    def __init__(self, base_url, ignore=None, archive_dead=False):
+    def __init__(self, base_url, ignore=None, archive_dead=False, concurrency=1, pool_size=None, http2=False, previous=None, checkpoint=None, resume=False, frontier=None, parser='html.parser', parse_workers=0, max_body_size=10_000_000, check_external=False, check_workers=16, link_cache=None, rate_limit=None, respect_robots=True, archive_endpoint=WAYBACK_ENDPOINT, archive_cache=None, metrics=None, dedup_content=False, near_dup_bits=3, strip_params=None, sort_params=False, max_depth=None, max_repeats=None, pattern_budget=None):
+        # rules for spelling every url the same way (dropping session ids and the like), if there are any
+        self.canonicalize = UrlCanonicalizer(strip_params, sort_params) if strip_params or sort_params else None
         self.base_url = self._normalize_url(base_url)
         self.domain = urlparse(self.base_url).netloc.lower()
-        self.queue = [self.base_url]
-        self.visited_keys = set()
+        # the queue of urls still to visit, plus the dedup keys we've already queued or visited
+        self.frontier = frontier if frontier is not None else MemoryFrontier()
+        self.frontier.push(self.base_url, self._stupid_dedup_key(self.base_url))
         self.ignore_regex = re.compile(ignore) if ignore else None
+        # once the crawl is done, look up archived copies of dead links (optionally remembering them in a SnapshotCache)
         self.archive_dead = archive_dead
+        self.archive_endpoint = archive_endpoint
+        self.archive_cache = archive_cache
         self.graph = LinkGraph()
         self.graph.set_root(self.base_url)
-        self.queued_keys = set()
+        # how many requests we're allowed to have on the wire at once
+        self.concurrency = max(1, int(concurrency))
+        # shared keep-alive connections; by default there's one pooled connection per worker
+        self.session = Session(pool_size=pool_size or self.concurrency, http2=http2)
+        # robots.txt, per-host rate limits and backing off when the server asks us to
+        self.scheduler = HostScheduler(self.session, max_rate=rate_limit, respect_robots=respect_robots)
+        # link graph from an earlier crawl, if we're only re-downloading what changed
+        self.previous = previous
+        self.unchanged = 0
+        # append-only journal of finished pages, so a crash doesn't cost us the whole crawl
+        self.checkpoint = Checkpoint(checkpoint) if checkpoint else None
+        self.resume = resume
+        # html.parser (BeautifulSoup) or lxml
+        self.parser = parser
+        # parsing is CPU-bound, so with parse_workers > 0 it happens in separate processes to get around the GIL
+        self.parse_workers = parse_workers
+        self._parse_pool = None
+        # how many documents can be waiting on the parser processes before the fetchers have to hold off
+        self._parse_slots = BoundedSemaphore(max(1, 2 * parse_workers))
+        # html/css bigger than this gets cut off rather than downloaded in full
+        self.max_body_size = max_body_size
+        # once the crawl is done, find out which external links still work (optionally remembering results in a LinkCache)
+        self.check_external = check_external
+        # the check has its own workers: it's hundreds of hosts that each want a request or two, whatever the crawl's concurrency
+        self.check_workers = max(1, int(check_workers))
+        self.link_cache = link_cache
+        # counters and timings (see metrics.py). None means nothing gets measured at all
+        self.metrics = metrics
+        self.session.metrics = metrics
+        # fingerprints of every page's content, so copies of a page get recorded as aliases (exact copies aren't followed)
+        self.content_index = ContentIndex(near_dup_bits) if dedup_content else None
+        self.duplicates = 0
+        # urls that look like crawler traps don't get queued
+        self.traps = TrapGuard(max_depth, max_repeats, pattern_budget) if max_depth or max_repeats or pattern_budget else None
 
 
     def run(self):
-        while self.queue:
-            current_url = self.queue.pop(0)
-
-            canon_key = self._stupid_dedup_key(current_url)
-            if canon_key in self.visited_keys:
-                continue
-            # no longer queued - this babys moving to the visited list
-            self.queued_keys.discard(canon_key)
-            self.visited_keys.add(canon_key)
-
-            Logger.print(2, f"Visiting {current_url}")
-            try:
-                response = requests.get(current_url, timeout=10, headers={'User-Agent': 'creepy-crawler'})
-                # follow redirects, and store the *correct* URL
-                current_url = response.url
-                content_type = response.headers.get('Content-Type', '').split(';')[0]
-                file_path = urlparse(response.url).path or "/"
-                Logger.print(2,f"Downloaded {file_path}!")
-                last_modified = response.headers.get('Last-Modified')
-                code = response.status_code
-                # 400 and higher represent HTTP error status codes.
-                is_broken = code >= 400
-                node = self.graph.get_or_create_node(
-                    current_url,
-                    content_type=content_type,
-                    response_code=code,
-                    last_modified=last_modified,
-                    broken=is_broken,
-                    external=False,
-                    file_path=file_path
-                )
-
-                # if it's an html document, pick it apart for links we can poach
-                if 'text/html' in content_type:
-                    node.title, links = self._parse_html(response.text, current_url)
-                elif 'text/css' in content_type:
-                    links = self._parse_css(response.text, current_url)
-                else:
-                    links = set()
-
-                Logger.print(2,node.to_dict())
-            except requests.exceptions.RequestException as e:
-                Logger.print(1, f"Request failed for {current_url}: {e}")
-                node = self.graph.get_or_create_node(
-                    current_url,
-                    response_code=-1,
-                    broken=True,
-                    external=False
-                )
-                links = set()
-
-            for link in links:
-                self._cue_up_link(node, link)
+        # the actual downloading happens on a pool of worker threads, but only this thread ever touches the
+        # graph or the queue. results are handled in the order they were sent out, so the graph comes out
+        # exactly the same as it would if we fetched one page at a time.
+        # anything already in the checkpoint journal gets replayed instead of fetched.
+        replay = self.checkpoint.load() if self.checkpoint and self.resume else {}
+        if self.checkpoint:
+            self.checkpoint.open(resume=self.resume)
+        # the parser processes are spawned fresh rather than forked: by the time the first page needs parsing, the
+        # fetch threads (and maybe the inventory, metrics and heartbeat threads) are running, and forking then can copy
+        # a lock some other thread is holding into a child that will never see it released
+        if self.parse_workers:
+            self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers, initializer=_ignore_interrupts,
+                                                   mp_context=multiprocessing.get_context("spawn"))
+        in_flight = deque()
+        if self.metrics:
+            self.metrics.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                # with a shared frontier, other workers can still turn up more links after our queue runs dry
+                while self.frontier or in_flight or self.frontier.busy():
+                    # keep the pipe full
+                    while self.frontier and len(in_flight) < self.concurrency:
+                        current_url = self._next_url()
+                        if not current_url:
+                            continue
+                        page = replay.pop(current_url, None)
+                        if page:
+                            future = Future()
+                            future.set_result(page)
+                            in_flight.append((future, False))
+                        else:
+                            in_flight.append((pool.submit(self._fetch, current_url), True))
+
+                    if self.metrics:
+                        self.metrics.queue_depth.set(len(self.frontier))
+                        self.metrics.in_flight.set(len(in_flight))
+                    if in_flight:
+                        future, fresh = in_flight.popleft()
+                        self._handle(future.result(), fresh)
+                        self.frontier.task_done()
+                    elif not self.frontier:
+                        time.sleep(0.2)
+
+            if self.check_external:
+                LinkChecker(self.session, concurrency=self.check_workers, cache=self.link_cache).check(self.graph)
+            if self.archive_dead:
+                ArchiveLookup(self.session, endpoint=self.archive_endpoint, cache=self.archive_cache).annotate(self.graph)
+        finally:
+            if self.metrics:
+                self.metrics.stop()
+            if self.checkpoint:
+                self.checkpoint.close()
+            self.frontier.close()
+            if self._parse_pool:
+                self._parse_pool.shutdown(cancel_futures=True)
+            if self.previous:
+                Logger.print(1, f"{self.unchanged} pages unchanged since the previous crawl")
+            if self.content_index:
+                Logger.print(1, f"{self.duplicates} pages were duplicates of others and were recorded as aliases")
+            if self.traps and self.traps.skipped:
+                reasons = ", ".join(f"{n} {reason}" for reason, n in self.traps.skipped.items())
+                Logger.print(1, f"Skipped {sum(self.traps.skipped.values())} urls that look like crawler traps ({reasons})")
+            Logger.print(1, f"Connection stats: {self.session.stats()}")
+            self.session.close()
 
         return self.graph
 
+    # pop the next url off the queue, or None if it turns out we've already been there
+    def _next_url(self):
+        current_url = self.frontier.pop()
+        # a shared frontier can be emptied by someone else between us checking and popping
+        if current_url is None:
+            return None
+
+        # no longer queued - this babys moving to the visited list
+        if not self.frontier.visit(self._stupid_dedup_key(current_url)):
+            self.frontier.task_done()
+            return None
+        if not self.scheduler.allowed(current_url):
+            Logger.print(1, f"Skipping {current_url} (disallowed by robots.txt)")
+            self.frontier.task_done()
+            return None
+        return current_url
+
+    # runs on a worker thread - downloads and picks apart one page, but doesn't touch any shared state.
+    # everything we learn goes into a plain dict (a "page") so it can be written to the checkpoint as-is.
+    def _fetch(self, url):
+        Logger.print(2, lambda: f"Visiting {url}")
+        started = time.perf_counter() if self.metrics else None
+        try:
+            # only the headers come down at first; we decide whether the body is worth having once we see the type
+            for attempt in range(self.scheduler.max_retries + 1):
+                self.scheduler.wait(url)
+                response = self.session.get(url, headers=self._conditional_headers(url), stream=True)
+                # the scheduler wants another go if we got throttled (it'll hold us back in wait() first)
+                if attempt == self.scheduler.max_retries or not self.scheduler.feedback(url, response.status_code, response.headers):
+                    break
+                Logger.print(2, f"Got {response.status_code} for {url}; retrying")
+                self.session.discard(response)
+            # 304 means nothing changed since last time, so reuse what we already know instead of parsing it again
+            if response.status_code == 304 and self._previous_node(url):
+                self.session.discard(response)
+                if self.metrics:
+                    self.metrics.fetch_seconds.observe(time.perf_counter() - started)
+                    self.metrics.responses.inc(label=304)
+                return self._reuse_previous(url, response)
+
+            content_type = response.headers.get('Content-Type', '').split(';')[0]
+            if self._parseable(content_type):
+                text, truncated = self.session.read_text(response, self.max_body_size)
+                if truncated:
+                    Logger.print(1, f"{response.url} is over {self.max_body_size} bytes; only the start of it was parsed")
+            else:
+                # images, pdfs, videos etc. only need the status and headers
+                self.session.discard(response)
+                text = None
+        except requests.exceptions.RequestException as e:
+            if self.metrics:
+                self.metrics.responses.inc(label="error")
+            Logger.print(1, f"Request failed for {url}: {e}")
+            return self._page(url, url, {"response_code": -1, "broken": True, "external": False})
+
+        # follow redirects, and store the *correct* URL
+        current_url = self._normalize_url(response.url)
+        file_path = urlparse(response.url).path or "/"
+        Logger.print(2, lambda: f"Downloaded {file_path}!")
+        code = response.status_code
+        if self.metrics:
+            self.metrics.fetch_seconds.observe(time.perf_counter() - started)
+            self.metrics.responses.inc(label=code)
+        meta = {
+            "content_type": content_type,
+            "response_code": code,
+            "last_modified": response.headers.get('Last-Modified'),
+            "etag": response.headers.get('ETag'),
+            # 400 and higher represent HTTP error status codes.
+            "broken": code >= 400,
+            "external": False,
+            "file_path": file_path,
+        }
+
+        links = set()
+        fingerprint = None
+        if text is not None:
+            # only pages that actually came back are worth comparing; every 404 page looks the same
+            title, links, fingerprint = self._parse(content_type, text, current_url, fingerprint=(self.content_index is not None and code == 200))
+            if title is not None:
+                meta["title"] = title
+
+        # every hop along the way, starting from the url we asked for
+        hops = [(url if i == 0 else r.url, r.status_code) for i, r in enumerate(response.history)]
+        return self._page(url, current_url, meta, links, redirects=hops, fingerprint=fingerprint)
+
+    # only html and css ever get parsed
+    def _parseable(self, content_type):
+        return 'text/html' in content_type or 'text/css' in content_type
+
+    # returns (title, links, fingerprint); the fingerprint is None unless asked for
+    def _parse(self, content_type, text, base, fingerprint=False):
+        if not self.metrics:
+            return self._parse_document(content_type, text, base, fingerprint)
+        started = time.perf_counter()
+        result = self._parse_document(content_type, text, base, fingerprint)
+        self.metrics.parse_seconds.observe(time.perf_counter() - started)
+        return result
+
+    def _parse_document(self, content_type, text, base, fingerprint):
+        if fingerprint and 'text/html' in content_type:
+            parse = parse_fingerprinted
+        else:
+            parse = _parse_plain
+        if not self._parse_pool:
+            return parse(content_type, text, base, self.parser)
+        # this blocks the fetching thread until a slot frees up, which is what stops us downloading faster than we can parse
+        with self._parse_slots:
+            return self._parse_pool.submit(parse, content_type, text, base, self.parser).result()
+
+    def _page(self, requested_url, url, meta, links=(), unchanged=False, redirects=(), fingerprint=None):
+        page = {"requested": requested_url, "url": url, "meta": meta, "links": list(links)}
+        if unchanged:
+            page["unchanged"] = True
+        if redirects:
+            page["redirects"] = [list(hop) for hop in redirects]
+        if fingerprint:
+            page["fingerprint"] = list(fingerprint)
+        return page
+
+    # back on the main thread: put what we learned about a page into the graph, and queue up its links
+    def _handle(self, page, fresh=True):
+        # replayed pages are already in the journal
+        if self.checkpoint and fresh:
+            self.checkpoint.record(page)
+        if page.get("unchanged"):
+            self.unchanged += 1
+        if self.metrics:
+            self.metrics.pages.inc()
+
+        links = page["links"]
+        # a copy of a page we already have is recorded as such. only an exact copy has its links (the same ones,
+        # surely) dropped: a near copy can differ in just the links - page 2 of a listing, say - so they're still followed.
+        # this happens here rather than on the workers so the first copy to be handled always wins
+        if self.content_index and page.get("fingerprint"):
+            match = self.content_index.add(page["url"], page["fingerprint"])
+            if match:
+                original, exact = match
+                self.duplicates += 1
+                Logger.print(2, lambda: f"Duplicate: {page['url']} has {'the same' if exact else 'nearly the same'} content as {original}")
+                page = {**page, "meta": {**page["meta"], "alias_of": original}}
+                if exact:
+                    links = ()
+
+        node = self.graph.get_or_create_node(page["url"], **page["meta"])
+        Logger.print(2, node.to_dict)
+
+        # each hop of a redirect points at the next, so whatever linked to the first url still leads to the page
+        hops = page.get("redirects", [])
+        for (hop_url, code), next_url in zip(hops, [u for u, _ in hops[1:]] + [page["url"]]):
+            hop = self.graph.get_or_create_node(hop_url, response_code=code, redirect=next_url)
+            hop.add_target(self.graph.get_or_create_node(next_url))
+
+        for link in links:
+            self._cue_up_link(node, link)
+
+    # if we saw this page last time, ask the server to only send it again if it's changed
+    def _conditional_headers(self, url):
+        old = self._previous_node(url)
+        if not old:
+            return None
+        headers = {}
+        if old.etag:
+            headers['If-None-Match'] = old.etag
+        if old.last_modified:
+            headers['If-Modified-Since'] = old.last_modified
+        return headers or None
+
+    # only pages that came back OK last time are worth reusing
+    def _previous_node(self, url):
+        if not self.previous:
+            return None
+        old = self.previous._crawled.get(url)
+        if old and old.response_code == 200 and not old.external:
+            return old
+        return None
+
+    def _reuse_previous(self, url, response):
+        old = self._previous_node(url)
+        Logger.print(2, f"Unchanged: {url}")
+        meta = {
+            "content_type": old.content_type,
+            "response_code": old.response_code,
+            # the server is allowed to send fresher validators along with the 304
+            "last_modified": response.headers.get('Last-Modified') or old.last_modified,
+            "etag": response.headers.get('ETag') or old.etag,
+            "title": old.title,
+            "broken": old.broken,
+            "external": False,
+            "file_path": old.file_path,
+            "alias_of": old.alias_of,
+        }
+        return self._page(url, url, meta, [target.url for target in old.links], unchanged=True)
+
     def _normalize_url(self, url):
-        # remove #fragment
-        base, _ = urldefrag(url)  
-        return base
+        url = normalize_url(url)
+        return self.canonicalize(url) if self.canonicalize else url
 
     def _stupid_dedup_key(self, url):
         base, _ = urldefrag(url)
@@ -87,33 +344,14 @@ class Crawler:
         # I had to do this because apparently some sites serve both http and https versions
         return f"{parsed.netloc.lower()}{parsed.path.rstrip('/') or '/'}"
 
-    def _parse_html(self, html, base):
-        # what a fun name
-        soup = BeautifulSoup(html, 'html.parser')
-        title = soup.title.string.strip() if soup.title and soup.title.string else ''
-        links = set()
-        # loop through all the tags that have links, and the corresponding attribute that holds the link.
-        # grab the links for all those.
-        for tag, attr in [('a', 'href'), ('link', 'href'), ('script', 'src'),
-                          ('img', 'src'), ('iframe', 'src'), ('source', 'src')]:
-            for el in soup.find_all(tag):
-                raw = el.get(attr)
-                if raw:
-                    link = urljoin(base, raw)
-                    links.add(self._normalize_url(link))
-        return title, links
-
-    def _parse_css(self, css_text, base_url):
-        # i'll be honest, I got this from stackoverflow. it's a very impressive regex.
-        pattern = re.compile(r'url\(\s*[\'"]?([^\'")]+)[\'"]?\s*\)', re.IGNORECASE)
-        return {self._normalize_url(urljoin(base_url, match)) for match in pattern.findall(css_text)}
-
     def _cue_up_link(self, source_node, target_url):
         #  apply regex filter to ignore parts of the site you don't want to index
         #  if the link matches, we can discard it
         if self.ignore_regex and self.ignore_regex.search(target_url):
-            Logger.print(2, f"Ignored (regex): {target_url}")
+            Logger.print(2, lambda: f"Ignored (regex): {target_url}")
             return
+        if self.canonicalize:
+            target_url = self.canonicalize(target_url)
 
         # ensure every URL has a unique normalised ID, regardless of schema
         canon_key = self._stupid_dedup_key(target_url)
@@ -125,10 +363,24 @@ class Crawler:
             source_node.add_target(node)
             return
 
-        # internal and not yet visited
-        if canon_key not in self.visited_keys and canon_key not in self.queued_keys:
-            self.queue.append(target_url)
-            self.queued_keys.add(canon_key)
+        # internal and not yet visited. anything that looks like a trap still goes in the graph, it just doesn't get crawled
+        if not self.frontier.seen(canon_key):
+            trap = self.traps.check(target_url) if self.traps else None
+            if trap:
+                Logger.print(2, lambda: f"Ignored ({trap}): {target_url}")
+            else:
+                self.frontier.push(target_url, canon_key)
 
         node = self.graph.get_or_create_node(target_url)
-        source_node.add_target(node)
\ No newline at end of file
+        source_node.add_target(node)
+
+
+# parse_document with an empty slot where the fingerprint would go (a module function, so it can go to a parser process)
+def _parse_plain(content_type, text, base, parser):
+    title, links = parse_document(content_type, text, base, parser)
+    return title, links, None
+
+
+# parser processes leave CTRL-C to the main process, which shuts them down itself
+def _ignore_interrupts():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
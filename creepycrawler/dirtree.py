@@ -1,42 +1,264 @@
 import subprocess
 import os
+import hashlib
+import shlex
+import tempfile
+from collections import defaultdict
 from pathlib import Path
 import re
-from .helpers import Logger
+import threading
+from urllib.parse import unquote
+from .helpers import Logger, JsonCache
 import creepycrawler
 import sys
 
+
+class InventoryCache(JsonCache):
+    """
+    What the webroot looked like last time: every directory's mtime, and every file's size, mtime and (if we were
+    asked to hash) content hash. Kept in the working directory. A directory's mtime only moves when something
+    is added, removed or renamed inside it, so a directory that hasn't moved can reuse last run's list of its files.
+    The cache only counts if it's for the same webroot and ignore regex.
+    """
+    DESCRIPTION = "inventory cache"
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.key, self.dirs, self.files = None, {}, {}
+        if self.data:
+            try:
+                self.key, self.dirs, self.files = self.data["key"], self.data["dirs"], self.data["files"]
+            except KeyError:
+                Logger.print(1, f"Ignoring unreadable {self.DESCRIPTION} {self.path}")
+
+    def for_tree(self, key):
+        if self.key != key:
+            self.dirs, self.files = {}, {}
+        self.key = key
+        return self
+
+    # what each directory held last time, so unchanged ones don't need listing
+    def children(self):
+        subdirs, files = defaultdict(list), defaultdict(list)
+        for d in self.dirs:
+            if d:
+                subdirs[d.rsplit("/", 1)[0]].append(d)
+        for f in self.files:
+            files[f.rsplit("/", 1)[0]].append(f)
+        return subdirs, files
+
+    def save(self, dirs, files):
+        self.dirs, self.files = dirs, files
+        self.data = {"key": self.key, "dirs": dirs, "files": files}
+        super().save()
+
+
 class FileTree:
-   # this is essentially a cheat -  instead of walking the file tree myself, I use the posix find command
-   # we'll then compare each line by line to see what is in the hashmap of visited pages and what's missing.
-   #  if the webroot is on a remote server, we'll log in via ssh and then run the command over tere instead
+   # takes inventory of every file in the webroot, so we can see what is in the hashmap of visited pages and what's missing.
+   # local webroots are walked directly; if the webroot is on a remote server, we log in via ssh and run find over there
+   # instead, reading its output as it arrives. either way it can run in the background (start, then wait) while the crawl goes.
+   # with a cache, only directories that changed since last time get listed again. with hash_files, every file's contents
+   # get hashed too (only re-hashing ones whose size or mtime moved), and anything that changed ends up in self.changed
+
+    PAGE_EXTENSIONS = {"html", "htm", "php"}
 
-    def __init__(self, webroot, ignore=None):
+    def __init__(self, webroot, ignore=None, cache=None, hash_files=False):
         self.user, self.host, path = self._parse_path(webroot)
         self._root = path
-        self._ignore = ignore
-        self.files = {}
-    
+        self._ignore = re.compile(ignore) if ignore else None
+        self.cache = cache.for_tree([webroot, ignore]) if cache else None
+        self.hash_files = hash_files
+        self.files = set()
+        self.changed = set()
+        self._old_dirs = self.cache.dirs if self.cache else {}
+        self._old_files = self.cache.files if self.cache else {}
+        # path -> mtime, and path -> [size, mtime, hash]; these become the next cache
+        self._dirs = {}
+        self._stats = {}
+        self._listed = 0
+        self._thread = None
+        self._error = None
+
     def generate(self):
+        self.start()
+        self.wait()
+
+    # begin taking inventory on a background thread
+    def start(self):
         Logger.print(1,f"Taking inventory of {self._root}")
-        local_cmd = f"cd {self._root} && find . -type f -name '*.*'"
+        self._thread = threading.Thread(target=self._inventory, name="inventory", daemon=True)
+        self._thread.start()
 
-        # if the webroot is on a remote system use ssh to run the command, otherwise use bash
-        if self.host:
-            cmd = ["ssh", f"{self.user}@{self.host}" if self.user else self.host, local_cmd]
-        else:
-            cmd = ["bash", "-c", local_cmd]
+    # block until the inventory is finished
+    def wait(self):
+        if self._thread is None:
+            self.start()
+        self._thread.join()
+        # die if we got an error
+        if self._error:
+            Logger.eprint(f"Error: {self._error}")
+            exit(1)
+        Logger.print(2,f"{len(self.files)} files found in {self._root} ({self._listed} of {len(self._dirs)} directories listed)")
+        if self.hash_files and self._old_files:
+            Logger.print(1,f"{len(self.changed)} files changed since the last inventory")
 
-        result = subprocess.run(cmd, capture_output=True, text=True)
+    def _inventory(self):
+        try:
+            walk = self._walk_remote() if self.host else self._walk_local()
+            for path in walk:
+                self.files.add(path)
+        except (OSError, RuntimeError) as e:
+            self._error = str(e)
+            return
+        if self.hash_files and self._old_files:
+            # new files count as changed; files we never hashed before can't be compared
+            self.changed = {p for p, (_, _, digest) in self._stats.items()
+                            if p not in self._old_files or self._old_files[p][2] not in (None, digest)}
+        # nothing listed means nothing new to remember
+        if self.cache and (self._listed or len(self._dirs) != len(self._old_dirs)):
+            self.cache.save(self._dirs, self._stats)
 
-        lines = result.stdout.strip().splitlines()
+    # files without a dot in their name are skipped, same as the find -name '*.*' this replaced
+    def _keep(self, name):
+        return '.' in name and not self._ignored(name)
 
-        # die if we got an error
-        if result.returncode != 0:
-            Logger.eprint(f"Error: {result.stderr.strip()}")
-            exit(1)
+    def _ignored(self, name):
+        return bool(self._ignore and self._ignore.search(name))
 
-        self.files = {"/" + line[2:] if line.startswith("./") else "/" + line for line in lines}
+    def _ignored_path(self, path):
+        return any(self._ignored(part) for part in path.split("/")[1:])
+
+    # does a directory need listing, or will last time's list of its contents do?
+    def _needs_listing(self, path, mtime):
+        self._dirs[path] = mtime
+        # hashing needs every file's size and mtime, and those change without the directory noticing
+        if self.hash_files or self._old_dirs.get(path) != mtime:
+            self._listed += 1
+            return True
+        return False
+
+    # keeps the old entry (and its hash) if the file looks untouched
+    def _stat(self, path, size, mtime):
+        old = self._old_files.get(path)
+        stat = self._stats[path] = old if old and old[0] == size and old[1] == mtime else [size, mtime, None]
+        return stat
+
+    def _children(self):
+        if self.cache:
+            return self.cache.children()
+        return defaultdict(list), defaultdict(list)
+
+    def _walk_local(self):
+        old_subdirs, old_files = self._children()
+        # (directory as a url path, the same directory on disk)
+        stack = [("", self._root)]
+        while stack:
+            prefix, directory = stack.pop()
+            try:
+                if not self._needs_listing(prefix, os.stat(directory).st_mtime_ns):
+                    for path in old_files[prefix]:
+                        self._stats[path] = self._old_files[path]
+                        yield path
+                    stack.extend((d, self._root + d) for d in old_subdirs[prefix])
+                    continue
+                entries = os.scandir(directory)
+            except OSError as e:
+                # like find, a subdirectory we can't read (or that just vanished) gets complained about and skipped
+                if not prefix:
+                    raise
+                Logger.eprint(f"Skipping {directory}: {e.strerror}")
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # an ignored directory is never even opened
+                        if not self._ignored(entry.name):
+                            stack.append((f"{prefix}/{entry.name}", entry.path))
+                    elif entry.is_file(follow_symlinks=False) and self._keep(entry.name):
+                        path = f"{prefix}/{entry.name}"
+                        st = entry.stat(follow_symlinks=False)
+                        stat = self._stat(path, st.st_size, st.st_mtime_ns)
+                        if self.hash_files and stat[2] is None:
+                            stat[2] = self._hash_local(entry.path)
+                        yield path
+
+    def _hash_local(self, path):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _walk_remote(self):
+        # first every directory and its mtime (there are far fewer of those than files), then only the directories that
+        # changed get their files listed. needs GNU find (for -printf) on the other end, and sha256sum for hashing
+        old_subdirs, old_files = self._children()
+        changed = set()
+        for path, mtime in self._remote_records("find . -type d -printf '%p\\0%T@\\0'", 2):
+            path = self._relative(path)
+            if not self._ignored_path(path) and self._needs_listing(path, mtime):
+                changed.add(path)
+
+        for directory in self._dirs:
+            if directory not in changed:
+                for path in old_files[directory]:
+                    self._stats[path] = self._old_files[path]
+                    yield path
+
+        to_hash = []
+        if changed:
+            lister = "find \"$@\" -mindepth 1 -maxdepth 1 -type f -name '*.*' -printf '%p\\0%s\\0%T@\\0'"
+            dirs = "".join(f".{d}\0" for d in changed)
+            for path, size, mtime in self._remote_records(f"xargs -0 sh -c {shlex.quote(lister)} sh", 3, stdin=dirs):
+                path = self._relative(path)
+                if self._ignored_path(path):
+                    continue
+                stat = self._stat(path, int(size), mtime)
+                if self.hash_files and stat[2] is None:
+                    to_hash.append(path)
+                yield path
+
+        if to_hash:
+            names = "".join(f".{p}\0" for p in to_hash)
+            for (line,) in self._remote_records("xargs -0 sha256sum -z", 1, stdin=names):
+                digest, path = line.split("  ", 1)
+                self._stats[self._relative(path)][2] = digest
+
+    # ./a/b.html -> /a/b.html, and . (the webroot itself) -> ""
+    def _relative(self, path):
+        return path.removeprefix(".")
+
+    # run a command in the remote webroot and read back groups of NUL separated fields as they arrive
+    def _remote_records(self, command, fields, stdin=None):
+        # (a leading ~ is left outside the quotes so the remote shell still expands it)
+        home, rest = ("~/", self._root[2:]) if self._root.startswith("~/") else ("", self._root)
+        remote_cmd = f"cd {home}{shlex.quote(rest) if rest else ''} && {command}"
+        cmd = ["ssh", f"{self.user}@{self.host}" if self.user else self.host, remote_cmd]
+        # stderr goes to a file, so a chatty find can't fill up a pipe nobody is reading and stall everything
+        with tempfile.TemporaryFile() as errors, subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors,
+                                                                  stdin=subprocess.DEVNULL if stdin is None else subprocess.PIPE) as proc:
+            if stdin is not None:
+                # fed from the side, or a big input and a big output could end up waiting on each other forever
+                threading.Thread(target=self._feed, args=(proc.stdin, os.fsencode(stdin)), daemon=True).start()
+            pending = b""
+            record = []
+            for chunk in iter(lambda: proc.stdout.read1(64 * 1024), b""):
+                *values, pending = (pending + chunk).split(b"\0")
+                for raw in values:
+                    record.append(os.fsdecode(raw))
+                    if len(record) == fields:
+                        yield record
+                        record = []
+            if proc.wait() != 0:
+                errors.seek(0)
+                raise RuntimeError(errors.read().decode(errors='replace').strip() or f"ssh exited with status {proc.returncode}")
+
+    def _feed(self, pipe, data):
+        try:
+            pipe.write(data)
+            pipe.close()
+        except BrokenPipeError:
+            pass
 
     def _parse_path(self,input_str):
         # parses a path of the form ([user@]host:)path/
@@ -49,7 +271,25 @@ class FileTree:
             # if it's a local file just return the local portion
             return None, None, input_str
 
-    
+
     def compare(self, linkgraph):
-        lg = linkgraph.view("file_path")
-        return [p for p in self.files if p not in lg and "{p}.html" not in lg and "{p}.php" not in lg]
+        # a set, so each lookup is O(1) instead of a scan of every node
+        return self.unmatched({unquote(p) for p in linkgraph.values("file_path") if p})
+
+    # files that none of the given url paths could have been served from
+    def unmatched(self, served):
+        return [p for p in self.files if not any(url in served for url in self._served_as(p))]
+
+    # the url paths a file might show up under: as itself, without its extension (/about.html as /about),
+    # and index files as their directory (/blog/index.html as /blog/ or /blog)
+    def _served_as(self, path):
+        yield path
+        stem, dot, ext = path.rpartition(".")
+        if ext.lower() not in self.PAGE_EXTENSIONS:
+            return
+        yield stem
+        directory, _, name = stem.rpartition("/")
+        if name == "index":
+            yield directory + "/"
+            if directory:
+                yield directory
@@ -0,0 +1,79 @@
+import re
+from hashlib import blake2b
+from .parsing import parse_document
+
+# everything that isn't text a reader would see: scripts, styles, comments and the tags themselves
+MARKUP = re.compile(r"<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>", re.DOTALL | re.IGNORECASE)
+WORD = re.compile(r"\w+")
+# words per shingle for the simhash, and how many shingles a page needs before near-matches mean anything
+SHINGLE = 3
+MIN_SHINGLES = 20
+
+
+# returns (exact, simhash) for an html page. both only look at the visible text, so pages that differ in nothing
+# but markup (a session id in every link, say) count as exactly the same. simhash is None for pages too short to tell
+def fingerprint(html):
+    words = WORD.findall(MARKUP.sub(" ", html).lower())
+    exact = blake2b(" ".join(words).encode("utf-8"), digest_size=16).hexdigest()
+    return exact, simhash(words)
+
+
+# a 64 bit hash where similar texts get similar bits: every shingle votes on every bit
+def simhash(words):
+    shingles = [" ".join(words[i:i + SHINGLE]) for i in range(len(words) - SHINGLE + 1)]
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    bits = [format(int.from_bytes(blake2b(s.encode("utf-8"), digest_size=8).digest(), "big"), "064b") for s in shingles]
+    # counting down the columns happens in C, rather than 64 python operations per shingle
+    half = len(bits) / 2
+    value = 0
+    for column in zip(*bits):
+        value = (value << 1) | (column.count("1") > half)
+    return value
+
+
+# parse_document plus the page's fingerprint, so both happen wherever the parsing does (e.g. in a parser process)
+def parse_fingerprinted(content_type, text, base, parser='html.parser'):
+    title, links = parse_document(content_type, text, base, parser)
+    return title, links, fingerprint(text)
+
+
+class ContentIndex:
+    """
+    Remembers the fingerprint of every page we've kept, to spot the next page with the same content.
+    Exact matches are a dict lookup. Near matches are pages whose simhashes differ in at most max_distance bits:
+    split the 64 bits into max_distance + 1 bands and two such hashes have to agree on at least one band entirely,
+    so only pages sharing a band ever get compared.
+    """
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        edges = [64 * i // bands for i in range(bands + 1)]
+        self._masks = [(((1 << (hi - lo)) - 1) << lo, lo) for lo, hi in zip(edges, edges[1:])]
+        self._exact = {}
+        # one dict per band: band value -> [(simhash, url), ...]
+        self._bands = [{} for _ in self._masks]
+
+    # (url of the page this one duplicates, whether it's an exact copy), or None if it's new (in which case it's
+    # remembered from now on)
+    def add(self, url, fingerprint):
+        exact, sim = fingerprint
+        original = self._exact.get(exact)
+        is_exact = original is not None
+        if not original and sim is not None:
+            original = self._near(sim)
+        # a page reached twice (through two different redirects, say) isn't a copy of itself
+        if original and original != url:
+            return original, is_exact
+        self._exact.setdefault(exact, url)
+        if sim is not None:
+            for band, (mask, shift) in zip(self._bands, self._masks):
+                band.setdefault((sim & mask) >> shift, []).append((sim, url))
+        return None
+
+    def _near(self, sim):
+        for band, (mask, shift) in zip(self._bands, self._masks):
+            for other, url in band.get((sim & mask) >> shift, ()):
+                if bin(sim ^ other).count("1") <= self.max_distance:
+                    return url
+        return None
@@ -0,0 +1,254 @@
+import os
+import socket
+import sqlite3
+import threading
+from collections import deque
+from hashlib import blake2b
+from pathlib import Path
+
+
+class MemoryFrontier:
+    """
+    The crawl queue plus the sets of dedup keys we've queued and visited, all in RAM.
+    A deque makes popping off the front O(1) instead of the O(n) list.pop(0) we used to do.
+    """
+    def __init__(self):
+        self._queue = deque()
+        self._queued = set()
+        self._visited = set()
+
+    # add a url to the back of the queue, remembering its key so we don't queue it twice
+    def push(self, url, key):
+        self._queue.append(url)
+        self._queued.add(key)
+
+    # next url in line, or None if we're out
+    def pop(self):
+        return self._queue.popleft() if self._queue else None
+
+    # has this key been queued or visited already?
+    def seen(self, key):
+        return key in self._visited or key in self._queued
+
+    # move a key over to the visited set. returns False if it was already there
+    def visit(self, key):
+        if key in self._visited:
+            return False
+        self._queued.discard(key)
+        self._visited.add(key)
+        return True
+
+    # done with a url we popped (whether or not it got fetched)
+    def task_done(self):
+        pass
+
+    # is anyone else still working on something that could add to the queue? only ever true when shared
+    def busy(self):
+        return False
+
+    def __len__(self):
+        return len(self._queue)
+
+    def close(self):
+        pass
+
+
+class DiskFrontier:
+    """
+    Same idea as MemoryFrontier, but the queue and the keys live in an SQLite file so memory stays bounded no matter
+    how many urls turn up. Keys are stored as 16-byte hashes rather than strings.
+    Only the two ends of the queue are kept in memory: a batch read ahead from the front, and a batch of pushes
+    waiting to be written at the back. Everything in the database is older than the write batch, so FIFO order holds.
+    """
+    def __init__(self, path, batch_size=1000, cache_kb=65536):
+        self.path = Path(path)
+        os.makedirs(self.path.parent, exist_ok=True)
+        # the frontier is rebuilt from the checkpoint on resume, so there's nothing in here worth keeping
+        if self.path.exists():
+            self.path.unlink()
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(f"PRAGMA cache_size=-{cache_kb}")
+        self._db.execute("CREATE TABLE queue (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL)")
+        # visited is 0 while a key is queued and 1 once it's been visited
+        self._db.execute("CREATE TABLE keys (key BLOB PRIMARY KEY, visited INTEGER NOT NULL) WITHOUT ROWID")
+        self.batch_size = batch_size
+        self._head = deque()
+        self._tail = []
+        self._on_disk = 0
+        self._writes = 0
+
+    def _hash(self, key):
+        return blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+    def push(self, url, key):
+        self._tail.append((url,))
+        self._db.execute("INSERT OR IGNORE INTO keys VALUES (?, 0)", (self._hash(key),))
+        if len(self._tail) >= self.batch_size:
+            self._spill()
+        self._tick()
+
+    def pop(self):
+        if not self._head:
+            self._refill()
+        return self._head.popleft() if self._head else None
+
+    def seen(self, key):
+        return self._db.execute("SELECT 1 FROM keys WHERE key = ?", (self._hash(key),)).fetchone() is not None
+
+    def visit(self, key):
+        h = self._hash(key)
+        row = self._db.execute("SELECT visited FROM keys WHERE key = ?", (h,)).fetchone()
+        if row and row[0]:
+            return False
+        self._db.execute("INSERT OR REPLACE INTO keys VALUES (?, 1)", (h,))
+        self._tick()
+        return True
+
+    def task_done(self):
+        pass
+
+    def busy(self):
+        return False
+
+    def __len__(self):
+        return len(self._head) + self._on_disk + len(self._tail)
+
+    def close(self):
+        self._db.close()
+        self.path.unlink(missing_ok=True)
+
+    # write the pending pushes to disk
+    def _spill(self):
+        self._db.executemany("INSERT INTO queue (url) VALUES (?)", self._tail)
+        self._on_disk += len(self._tail)
+        self._tail = []
+
+    # pull the next batch off the front of the queue; once the database runs dry the write batch is next in line
+    def _refill(self):
+        if self._on_disk:
+            rows = self._db.execute("SELECT id, url FROM queue ORDER BY id LIMIT ?", (self.batch_size,)).fetchall()
+            self._db.execute("DELETE FROM queue WHERE id <= ?", (rows[-1][0],))
+            self._on_disk -= len(rows)
+            self._head.extend(url for _, url in rows)
+        else:
+            self._head.extend(url for url, in self._tail)
+            self._tail = []
+
+    # commit every so often rather than after every single statement
+    def _tick(self):
+        self._writes += 1
+        if self._writes >= self.batch_size:
+            self._db.commit()
+            self._writes = 0
+
+
+class RedisFrontier:
+    """
+    A frontier shared through Redis by any number of crawl workers, on any number of machines. The queue is a list
+    and the dedup keys are sets, so whichever worker finds a link first is the one that queues it, and whichever
+    pops it first is the one that fetches it.
+    Each worker counts the urls it has popped but not finished with, and keeps a heartbeat key alive while it runs.
+    The crawl is over once the queue is empty and no live worker is holding anything - a worker that died doesn't
+    hold everyone else up, but whatever it was holding is lost until the next crawl. Once it's over the keys expire
+    after a while, so the next crawl with the same name starts from scratch.
+    """
+    def __init__(self, client, name, worker=None, heartbeat=10, expire=3600):
+        self.client = client
+        self.prefix = f"creepycrawler:{name}:"
+        self.worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+        self._queue = self.prefix + "queue"
+        # every key ever queued (they never leave), and every key a worker has claimed
+        self._seen = self.prefix + "seen"
+        self._visited = self.prefix + "visited"
+        # worker -> how many popped urls it hasn't finished with yet
+        self._pending = self.prefix + "pending"
+        self._alive = self.prefix + "alive:"
+        # keys we already know are taken. once seen, always seen, so there's no need to ask redis twice
+        self._known = set()
+        self.heartbeat = heartbeat
+        self.expire = expire
+        self._stop = threading.Event()
+        self._beat()
+        self._thread = threading.Thread(target=self._keep_alive, name="frontier-heartbeat", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def connect(cls, url, name, **kwargs):
+        # redis takes a while to import, and most crawls never need it
+        import redis
+        return cls(redis.Redis.from_url(url), name, **kwargs)
+
+    def push(self, url, key):
+        self._known.add(key)
+        # only the worker that actually adds the key gets to queue the url
+        if self.client.sadd(self._seen, key):
+            self.client.rpush(self._queue, url)
+
+    # the pop and the count go together, so nobody can catch the queue empty while we're holding its last url
+    def pop(self):
+        pipe = self.client.pipeline()
+        pipe.lpop(self._queue)
+        pipe.hincrby(self._pending, self.worker, 1)
+        url, _ = pipe.execute()
+        if url is None:
+            # someone else got there first
+            self.task_done()
+            return None
+        return _text(url)
+
+    def seen(self, key):
+        if key in self._known:
+            return True
+        if self.client.sismember(self._seen, key):
+            self._known.add(key)
+            return True
+        return False
+
+    def visit(self, key):
+        return bool(self.client.sadd(self._visited, key))
+
+    def task_done(self):
+        self.client.hincrby(self._pending, self.worker, -1)
+
+    def busy(self):
+        pipe = self.client.pipeline()
+        pipe.llen(self._queue)
+        pipe.hgetall(self._pending)
+        queued, pending = pipe.execute()
+        if queued:
+            return True
+        holders = [_text(w) for w, n in pending.items() if int(n) > 0 and _text(w) != self.worker]
+        return bool(holders) and self.client.exists(*(self._alive + w for w in holders)) > 0
+
+    def __len__(self):
+        return self.client.llen(self._queue)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.client.delete(self._alive + self.worker)
+        self.client.hdel(self._pending, self.worker)
+        # the last one out starts the clock on the crawl's keys; stragglers can still see what happened until then
+        if not self.busy():
+            pipe = self.client.pipeline()
+            for key in (self._queue, self._seen, self._visited, self._pending):
+                pipe.expire(key, self.expire)
+            pipe.execute()
+
+    def _beat(self):
+        self.client.set(self._alive + self.worker, 1, ex=self.heartbeat * 3)
+
+    def _keep_alive(self):
+        while not self._stop.wait(self.heartbeat):
+            try:
+                self._beat()
+            except Exception:
+                # whatever went wrong, the main thread will find out soon enough
+                pass
+
+
+# redis hands back bytes unless the client was made with decode_responses=True
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
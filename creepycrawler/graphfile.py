@@ -0,0 +1,236 @@
+"""
+Compact binary link graph ("ccg"), laid out so it can be mmapped and queried without building any Python objects
+up front. Everything is little-endian, and sections are padded to 8 bytes:
+
+    header       magic, flags, node/string/edge counts, root id, length of the field list
+    fields       JSON list of the string fields stored per node (so new fields don't break old files)
+    -- everything below here is zstd-compressed if the compressed flag is set --
+    str_offsets  u64 x (strings + 1) string i is blob[str_offsets[i]:str_offsets[i+1]]
+    str_blob     utf-8              strings 0..nodes-1 are the node urls, in node order
+    records      i32 x (fields + 2) per node: a string id for each field (-1 for None),
+                                    then the response code, then flags (1 = broken, 2 = external, 4 = has code)
+    out_offsets  u64 x (nodes + 1)  CSR adjacency: node i links to out_edges[out_offsets[i]:out_offsets[i+1]]
+    out_edges    u32 x edges
+    in_offsets   u64 x (nodes + 1)  the same again for inbound links
+    in_edges     u32 x edges
+    by_url       u32 x nodes        node ids sorted by url bytes, for binary search
+"""
+
+import json
+import mmap
+import struct
+from array import array
+from .linkgraph import LinkGraph, Node
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"CCG\x01"
+HEADER = struct.Struct("<4sIIIQqI")
+COMPRESSED = 1
+STRING_FIELDS = ("content_type", "last_modified", "etag", "title", "file_path", "redirect", "archive", "alias_of")
+BROKEN, EXTERNAL, HAS_CODE = 1, 2, 4
+
+
+def _pad(n):
+    return b"\0" * (-n % 8)
+
+
+def write(graph, fp, compress=False):
+    nodes = graph._nodes
+    # node urls take the first string ids, everything else is deduplicated after them
+    strings = [node.url for node in nodes]
+    ids = {}
+
+    def sid(value):
+        if value is None:
+            return -1
+        if value not in ids:
+            ids[value] = len(strings)
+            strings.append(value)
+        return ids[value]
+
+    width = len(STRING_FIELDS) + 2
+    records = array('i')
+    for node in nodes:
+        records.extend(sid(getattr(node, f)) for f in STRING_FIELDS)
+        flags = (BROKEN if node.broken else 0) | (EXTERNAL if node.external else 0) | (HAS_CODE if node.response_code is not None else 0)
+        records.append(node.response_code or 0)
+        records.append(flags)
+    assert len(records) == width * len(nodes)
+
+    encoded = [s.encode('utf-8') for s in strings]
+    str_offsets = array('Q', [0])
+    for b in encoded:
+        str_offsets.append(str_offsets[-1] + len(b))
+
+    def csr(lists):
+        offsets, edges = array('Q', [0]), array('I')
+        for ids in lists:
+            edges.extend(ids.compact())
+            offsets.append(len(edges))
+        return offsets, edges
+
+    out_offsets, out_edges = csr(node._targets for node in nodes)
+    in_offsets, in_edges = csr(graph._reverse())
+    by_url = array('I', sorted(range(len(nodes)), key=lambda i: encoded[i]))
+
+    fields = json.dumps(STRING_FIELDS).encode('utf-8')
+    if compress and zstandard is None:
+        raise ValueError("compressed graphs need the zstandard package (pip install zstandard)")
+    root = graph.root.uid if graph.root else -1
+    fp.write(HEADER.pack(MAGIC, COMPRESSED if compress else 0, len(nodes), len(strings), len(out_edges), root, len(fields)))
+    fp.write(fields + _pad(HEADER.size + len(fields)))
+
+    out = zstandard.ZstdCompressor().stream_writer(fp, closefd=False) if compress else fp
+    blob_len = str_offsets[-1]
+    for section in (str_offsets.tobytes(), b"".join(encoded) + _pad(blob_len), records.tobytes() + _pad(len(records) * 4),
+                    out_offsets.tobytes(), out_edges.tobytes() + _pad(len(out_edges) * 4),
+                    in_offsets.tobytes(), in_edges.tobytes() + _pad(len(in_edges) * 4), by_url.tobytes()):
+        out.write(section)
+    if compress:
+        out.flush(zstandard.FLUSH_FRAME)
+
+
+class MappedGraph:
+    """
+    Read-only view of a ccg file. Lookups go straight to the mapped bytes and only build the Nodes they return,
+    so answering a question about a few urls costs next to nothing no matter how big the graph is.
+    Compressed files have to be decompressed into memory first, but are still never turned into a whole LinkGraph.
+    """
+    def __init__(self, buffer):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, flags, self._n, n_strings, n_edges, root, fields_len = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError("not a creepy-crawler binary graph")
+        start = HEADER.size + fields_len
+        self._fields = json.loads(bytes(view[HEADER.size:start]))
+        start += -start % 8
+        body = view[start:]
+        if flags & COMPRESSED:
+            if zstandard is None:
+                raise ValueError("compressed graphs need the zstandard package (pip install zstandard)")
+            body = memoryview(zstandard.ZstdDecompressor().decompressobj().decompress(body))
+
+        pos = 0
+
+        def take(nbytes, fmt):
+            nonlocal pos
+            section = body[pos:pos + nbytes].cast(fmt) if fmt else body[pos:pos + nbytes]
+            pos += nbytes + (-nbytes % 8)
+            return section
+
+        n = self._n
+        self._width = len(self._fields) + 2
+        self._str_offsets = take(8 * (n_strings + 1), 'Q')
+        self._blob = take(self._str_offsets[-1], None)
+        self._records = take(4 * self._width * n, 'i')
+        self._out_offsets = take(8 * (n + 1), 'Q')
+        self._out_edges = take(4 * n_edges, 'I')
+        self._in_offsets = take(8 * (n + 1), 'Q')
+        self._in_edges = take(4 * n_edges, 'I')
+        self._by_url = take(4 * n, 'I')
+        self._root = root
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __len__(self):
+        return self._n
+
+    def __contains__(self, url):
+        return self._find(url) is not None
+
+    def visited(self, url):
+        return url in self
+
+    @property
+    def root(self):
+        return self._node(self._root) if self._root >= 0 else None
+
+    def node(self, url):
+        i = self._find(url)
+        return self._node(i) if i is not None else None
+
+    # every node, built one at a time as you go
+    def nodes(self):
+        return (self._node(i) for i in range(self._n))
+
+    def urls(self):
+        return (self._string(i) for i in range(self._n))
+
+    def links(self, url):
+        return self._neighbours(url, self._out_offsets, self._out_edges)
+
+    def inbound(self, url):
+        return [self._node(self._find(u)) for u in self._neighbours(url, self._in_offsets, self._in_edges)]
+
+    def in_degree(self, url):
+        i = self._find(url)
+        return self._in_offsets[i + 1] - self._in_offsets[i] if i is not None else 0
+
+    def column(self, feature):
+        if feature == "url":
+            return list(self.urls())
+        return [getattr(self._node(i), feature) for i in range(self._n)]
+
+    def values(self, feature):
+        return frozenset(self.column(feature))
+
+    # only needs nodes(), so the LinkGraph version works as-is
+    write_sitemap = LinkGraph.write_sitemap
+
+    # materialize the whole thing, for when you really do need a LinkGraph
+    def to_graph(self):
+        graph = LinkGraph()
+        for i in range(self._n):
+            graph._add(self._node(i))
+        for node in graph._nodes:
+            lo, hi = self._out_offsets[node.uid], self._out_offsets[node.uid + 1]
+            for target in self._out_edges[lo:hi]:
+                node.add_target(graph._nodes[target])
+        if self._root >= 0:
+            graph.root = graph._nodes[self._root]
+        return graph
+
+    def _string(self, sid):
+        if sid < 0:
+            return None
+        return bytes(self._blob[self._str_offsets[sid]:self._str_offsets[sid + 1]]).decode('utf-8')
+
+    def _node(self, i):
+        rec = self._records[i * self._width:(i + 1) * self._width]
+        node = Node(self._string(i), **{f: self._string(rec[k]) for k, f in enumerate(self._fields)})
+        code, flags = rec[-2], rec[-1]
+        node.response_code = code if flags & HAS_CODE else None
+        node.broken = bool(flags & BROKEN)
+        node.external = bool(flags & EXTERNAL)
+        node.uid = i
+        return node
+
+    def _neighbours(self, url, offsets, edges):
+        i = self._find(url)
+        if i is None:
+            return []
+        return [self._string(j) for j in edges[offsets[i]:offsets[i + 1]]]
+
+    # binary search over the url-sorted index
+    def _find(self, url):
+        key = url.encode('utf-8')
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = self._by_url[mid]
+            probe = bytes(self._blob[self._str_offsets[i]:self._str_offsets[i + 1]])
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return i
+        return None
@@ -1,4 +1,6 @@
 import sys, os
+import json
+import time
 from pathlib import Path
 from contextlib import contextmanager
 
@@ -20,14 +22,14 @@ class RWTool:
             p = RWTool.__working_dir / p
 
         # if writing, create parent directory if it doesn't yet exist
-        if mode=='w': 
+        if 'w' in mode: 
             os.makedirs(p.parent, exist_ok=True)
             Logger.print(2, f"{p.parent} created")
 
         with open(p, mode) as f:
         # hand file back to caller
             yield f
-            if mode=='r':
+            if 'r' in mode:
                 Logger.print(2, f"{p} read")
             else:
                 Logger.print(1, f"{p} written")
@@ -51,7 +53,9 @@ class Logger:
     def print(level=2, *args, **kwargs):
         # don't print if below level
         if level > Logger.__verbosity_level: return
-        print(*args, **kwargs)
+        # anything expensive to build can be passed as a function (e.g. node.to_dict, or a lambda), and only
+        # gets called here, once we know it'll be shown
+        print(*(arg() if callable(arg) else arg for arg in args), **kwargs)
         
 
 
@@ -83,3 +87,50 @@ def valid_path(p_str, dir=True, mode="rw", fatal=False):
         if fatal: Logger.eprint(f"Error: {p} {e}")
         if not fatal: return None
         sys.exit(1)
+
+
+class JsonCache:
+    """
+    A dict kept in a JSON file between runs (self.data). It's only ever a cache, so a file that can't be read is
+    ignored and overwritten on the next save. With a ttl, put() stamps each entry with when it was checked, get()
+    treats entries older than ttl_for(entry) seconds as missing, and save() drops them so the file doesn't grow forever.
+    """
+    DESCRIPTION = "cache"
+
+    def __init__(self, path, ttl=None):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.data = {}
+        if self.path.exists():
+            try:
+                with open(self.path, 'r') as f:
+                    self.data = json.load(f)
+            except ValueError:
+                Logger.print(1, f"Ignoring unreadable {self.DESCRIPTION} {self.path}")
+
+    # the entry for key, or None if there isn't one or it's expired
+    def get(self, key):
+        entry = self.data.get(key)
+        return entry if entry and self._fresh(entry, time.time()) else None
+
+    def put(self, key, **values):
+        self.data[key] = {**values, "checked": time.time()}
+
+    # how long an entry stays good, for caches where that depends on what's in it
+    def ttl_for(self, entry):
+        return self.ttl
+
+    def save(self):
+        if self.ttl is not None:
+            now = time.time()
+            self.data = {key: e for key, e in self.data.items() if self._fresh(e, now)}
+        os.makedirs(self.path.parent, exist_ok=True)
+        # write to the side and swap it in, so a crash can't leave half a file behind
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+    def _fresh(self, entry, now):
+        ttl = self.ttl_for(entry)
+        return ttl is None or now - entry["checked"] < ttl
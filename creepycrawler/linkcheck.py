@@ -0,0 +1,93 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from threading import BoundedSemaphore
+from urllib.parse import urlparse
+import requests
+from .helpers import Logger, JsonCache
+
+
+class LinkCache(JsonCache):
+    """
+    Remembers what each external url returned and when, so nightly runs don't re-check links that were fine a few
+    hours ago. Entries older than ttl seconds are treated as missing.
+    """
+    DESCRIPTION = "link cache"
+
+    def __init__(self, path, ttl=86400):
+        super().__init__(path, ttl)
+
+    # the cached status code for a url, or None if we haven't checked it recently
+    def get(self, url):
+        entry = super().get(url)
+        return entry["code"] if entry else None
+
+    def put(self, url, code):
+        super().put(url, code=code)
+
+
+class LinkChecker:
+    """
+    Finds out whether the external links in a graph still work, filling in response_code and broken on each
+    external node. Every distinct url is checked once, with a HEAD request that falls back to GET (lots of
+    servers don't handle HEAD properly), and no more than per_host requests go to any one host at a time.
+    """
+    def __init__(self, session, concurrency=16, per_host=2, cache=None):
+        self.session = session
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.cache = cache
+
+    def check(self, graph):
+        nodes = [node for node in graph._crawled.values() if node.external]
+        todo = []
+        for node in nodes:
+            code = self.cache.get(node.url) if self.cache else None
+            if code is None:
+                todo.append(node)
+            else:
+                self._record(graph, node, code)
+        Logger.print(1, f"Checking {len(todo)} external links ({len(nodes) - len(todo)} cached)")
+
+        # one semaphore per host. the work is dealt out host by host, round robin, so workers
+        # mostly aren't stuck waiting on the same busy host
+        by_host = defaultdict(list)
+        for node in todo:
+            by_host[urlparse(node.url).netloc.lower()].append(node)
+        limits = {host: BoundedSemaphore(self.per_host) for host in by_host}
+        interleaved = [node for batch in zip_longest(*by_host.values()) for node in batch if node]
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            codes = pool.map(lambda node: self._status(node.url, limits[urlparse(node.url).netloc.lower()]), interleaved)
+            # only this thread touches the graph and the cache
+            for node, code in zip(interleaved, codes):
+                self._record(graph, node, code)
+                if self.cache:
+                    self.cache.put(node.url, code)
+
+        if self.cache:
+            self.cache.save()
+        broken = sum(1 for node in nodes if node.broken)
+        Logger.print(1, f"{broken} of {len(nodes)} external links are broken")
+
+    def _record(self, graph, node, code):
+        # going through the graph keeps its cached columns honest
+        graph.get_or_create_node(node.url, response_code=code, broken=code < 0 or code >= 400)
+        if node.broken:
+            Logger.print(1, f"Broken external link: {node.url} ({code})")
+
+    # runs on a worker thread
+    def _status(self, url, limit):
+        with limit:
+            try:
+                response = self.session.head(url)
+                response.close()
+                if response.status_code < 400:
+                    return response.status_code
+                # plenty of servers answer HEAD with 403/405/501 (or worse) but serve GET just fine
+                response = self.session.get(url, stream=True)
+                self.session.discard(response)
+                return response.status_code
+            except requests.exceptions.RequestException as e:
+                Logger.print(2, f"External check failed for {url}: {e}")
+                return -1
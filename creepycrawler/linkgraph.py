@@ -1,25 +1,145 @@
 from .helpers import Logger 
-from xml.etree.ElementTree import Element, SubElement, tostring
-import xml.dom.minidom
-import datetime
-
+import io
 import json
+from array import array
+from pathlib import Path
+
+
+class _Ids:
+    # an ordered set of node ids packed into an array (4 bytes each, instead of an 8 byte pointer plus a
+    # hash table entry). adding is O(1): duplicates get appended like anything else and weeded out in bulk
+    # once the array has doubled in size since the last cleanup, or whenever someone reads it.
+    __slots__ = ('ids', 'clean')
+
+    def __init__(self, ids=()):
+        self.ids = array('I', ids)
+        self.clean = 0
+
+    def add(self, uid):
+        self.ids.append(uid)
+        if len(self.ids) >= 2 * self.clean + 8:
+            self.compact()
+
+    def compact(self):
+        if len(self.ids) != self.clean:
+            # dict keys keep insertion order, so the first occurrence of each id wins
+            self.ids = array('I', dict.fromkeys(self.ids))
+            self.clean = len(self.ids)
+        return self.ids
+
+    def discard(self, uid):
+        self.ids = array('I', (i for i in self.compact() if i != uid))
+        self.clean = len(self.ids)
+
+    def __len__(self):
+        return len(self.compact())
+
+
+class _Links(list):
+    # node.links is built fresh on every call, so adding to it has to go through to the node itself.
+    # anything else that would change it in place is refused, rather than quietly doing nothing
+    __slots__ = ('node',)
+
+    def __init__(self, node, nodes):
+        super().__init__(nodes)
+        self.node = node
+
+    def append(self, target):
+        self.node.add_target(target)
+        if target not in self:
+            super().append(target)
+
+    def extend(self, targets):
+        for target in targets:
+            self.append(target)
+
+    def __iadd__(self, targets):
+        self.extend(targets)
+        return self
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("node.links can only be appended to; assign a new list to node.links to replace them")
+
+    insert = remove = pop = clear = sort = reverse = __setitem__ = __delitem__ = __imul__ = _read_only
+
+
 class Node:
-    def __init__(self, url, content_type=None, response_code=None, last_modified=None, title=None, broken=False, external=False, file_path=None):
+    # __slots__ makes every node a fixed-size object instead of one dragging its own __dict__ around
+    __slots__ = ('url', 'content_type', 'response_code', 'last_modified', 'etag', 'title', 'broken', 'external',
+                 'file_path', 'redirect', 'archive', 'alias_of', 'uid', '_graph', '_targets', '_link_urls', '_loose')
+    # everything we know about a url, as opposed to the graph's bookkeeping
+    FIELDS = ('content_type', 'response_code', 'last_modified', 'etag', 'title', 'broken', 'external', 'file_path', 'redirect', 'archive', 'alias_of')
+
+    def __init__(self, url, content_type=None, response_code=None, last_modified=None, title=None, broken=False, external=False, file_path=None, etag=None, redirect=None, archive=None, alias_of=None):
         self.url = url
         self.content_type = content_type
         self.response_code = response_code
         self.last_modified = last_modified
+        self.etag = etag
         self.title = title
         self.broken = broken
         self.external = external
         self.file_path = file_path
-        # list of target Node objects (i.e. any resources loaded by the page)
-        self.links = []
+        # where this url redirected to, if it did
+        self.redirect = redirect
+        # the Internet Archive's latest copy, for dead links
+        self.archive = archive
+        # the page this one has the same (or nearly the same) content as, if it's a duplicate
+        self.alias_of = alias_of
+        # the graph hands out a uid, and keeps the uid -> node list so ids can be turned back into nodes
+        self.uid = None
+        self._graph = None
+        # ids of target Nodes (i.e. any resources loaded by the page). the other direction is the graph's job
+        self._targets = _Ids()
+        self._link_urls = None
+        # edges to or from nodes that aren't in this node's graph (or any graph) yet, as plain [targets, sources]
+        # lists of Nodes. they become ids once both ends are in the same graph
+        self._loose = None
+
+    # list of target Node objects. appending to it adds a link, just like add_target
+    @property
+    def links(self):
+        nodes = [self._graph._nodes[uid] for uid in self._targets.compact()] if self._graph is not None else []
+        if self._loose:
+            nodes += [n for n in self._loose[0] if n not in nodes]
+        return _Links(self, nodes)
+
+    @links.setter
+    def links(self, nodes):
+        # keep the reverse edges in step
+        for old in self.links:
+            if self._loose and old in self._loose[0]:
+                self._loose[0].remove(old)
+                old._loose[1].remove(self)
+            elif self._graph._sources is not None:
+                self._graph._sources[old.uid].discard(self.uid)
+        self._targets = _Ids()
+        for node in nodes:
+            self.add_target(node)
+
+    # list of Nodes that link to this one
+    @property
+    def sources(self):
+        nodes = [self._graph._nodes[uid] for uid in self._graph._reverse()[self.uid].compact()] if self._graph is not None else []
+        if self._loose:
+            nodes += [n for n in self._loose[1] if n not in nodes]
+        return nodes
 
     def add_target(self, target_node):
-        if all(target.url != target_node.url for target in self.links):
-            self.links.append(target_node)
+        if self._graph is None or self._graph is not target_node._graph:
+            # not both in the same graph (yet), so there are no ids to link up
+            if target_node not in self._get_loose()[0]:
+                self._loose[0].append(target_node)
+                target_node._get_loose()[1].append(self)
+            return
+        self._targets.add(target_node.uid)
+        if self._graph._sources is not None:
+            self._graph._sources[target_node.uid].add(self.uid)
+
+    def _get_loose(self):
+        if self._loose is None:
+            self._loose = [[], []]
+        return self._loose
     
     def to_dict(self):
         return {
@@ -27,10 +147,14 @@ class Node:
             "content_type": self.content_type,
             "response_code": self.response_code,
             "last_modified": self.last_modified,
+            "etag": self.etag,
             "title": self.title,
             "broken": self.broken,
             "external": self.external,
             "file_path": self.file_path,
+            "redirect": self.redirect,
+            "archive": self.archive,
+            "alias_of": self.alias_of,
             "links": [n.url for n in self.links],  # only store URLs
     }
 
@@ -45,6 +169,10 @@ class Node:
             broken=data.get("broken", False),
             external=data.get("external", False),
             file_path=data.get("file_path"),
+            etag=data.get("etag"),
+            redirect=data.get("redirect"),
+            archive=data.get("archive"),
+            alias_of=data.get("alias_of"),
         )
         # placeholder for links
         node._link_urls = data.get("links", [])
@@ -60,10 +188,44 @@ class LinkGraph:
         # store all nodes in dictionary (hashmap)
         # O1 access :D
         self._crawled = {}
+        # and by uid, which is just the order they were added in
+        self._nodes = []
+        # uid -> _Ids of the nodes linking there. nothing needs it while crawling, so it's only built (from every
+        # node's targets) the first time someone asks who links where, and kept in step from then on
+        self._sources = None
+        # cached columns (feature -> list of values) and their sets; thrown out whenever the graph changes
+        self._columns = {}
+        self._column_sets = {}
     
-    # provide access to data from the nodes - TODO make this more efficient
+    # provide access to data from the nodes - one value per node, in the order they were added.
+    # a copy, so callers can do what they like with it; column() is the cached one
     def view(self,feature):
-        return [ node.to_dict()[feature] for node in self._crawled.values() ]
+        return list(self.column(feature))
+
+    # every node's value for one feature, built on first use and cached until the graph changes.
+    # treat it as read-only! links aren't cached, since they can change without the graph hearing about it
+    def column(self, feature):
+        if feature == "links":
+            return [[n.url for n in node.links] for node in self._nodes]
+        col = self._columns.get(feature)
+        if col is None:
+            if feature not in Node.__slots__ or feature.startswith('_'):
+                raise KeyError(feature)
+            col = self._columns[feature] = [getattr(node, feature) for node in self._nodes]
+        return col
+
+    # the distinct values of a feature, for fast "is this in the graph?" questions
+    def values(self, feature):
+        s = self._column_sets.get(feature)
+        if s is None:
+            s = self._column_sets[feature] = frozenset(self.column(feature))
+        return s
+
+    # anything that changes node attributes behind the graph's back should call this afterwards
+    def invalidate(self):
+        if self._columns:
+            self._columns.clear()
+            self._column_sets.clear()
 
     # determine if a link has yet been visited 
     def visited(self, url):
@@ -71,8 +233,10 @@ class LinkGraph:
 
     # create a new node for a new link, otherwise return a reference to the existing node
     def get_or_create_node(self, url, **kwargs):
+        if kwargs or url not in self._crawled:
+            self.invalidate()
         if url not in self._crawled:
-            self._crawled[url] = Node(url, **kwargs)
+            self._add(Node(url, **kwargs))
         else:
             # crucially, if the node does exist make sure all of its items are updated with new information
             node = self._crawled[url]
@@ -81,6 +245,62 @@ class LinkGraph:
 
         return self._crawled[url]
 
+    def _add(self, node):
+        node.uid = len(self._nodes)
+        node._graph = self
+        self._nodes.append(node)
+        if self._sources is not None:
+            self._sources.append(_Ids())
+        self._crawled[node.url] = node
+        if node._loose:
+            self._tie_up(node)
+        return node
+
+    # a node that was linked up before it joined the graph: its links come along with it, as real edges
+    def _tie_up(self, node):
+        targets, sources = node._loose
+        node._loose = None
+        # unhook everything first, so nodes pulled in along the way don't come back round to this one
+        for target in targets:
+            target._loose[1].remove(node)
+        for source in sources:
+            source._loose[0].remove(node)
+        for target in targets:
+            node.add_target(self._member(target))
+        for source in sources:
+            self._member(source).add_target(node)
+
+    # the graph's own node for this one's url, adding it if there isn't one
+    def _member(self, node):
+        if node._graph is self:
+            return node
+        if node.url in self._crawled:
+            return self._crawled[node.url]
+        return self._add(node) if node.uid is None else self.get_or_create_node(node.url)
+
+    # the reverse edges, building them if this is the first time they're needed
+    def _reverse(self):
+        if self._sources is None:
+            sources = [_Ids() for _ in self._nodes]
+            for node in self._nodes:
+                for uid in node._targets.compact():
+                    sources[uid].ids.append(node.uid)
+            # each node's targets are distinct, so these already are too
+            for ids in sources:
+                ids.clean = len(ids.ids)
+            self._sources = sources
+        return self._sources
+
+    # every node that links to url (e.g. who do we need to tell about this 404?)
+    def inbound(self, url):
+        node = self._crawled.get(url)
+        return node.sources if node else []
+
+    # how many distinct pages link to url
+    def in_degree(self, url):
+        node = self._crawled.get(url)
+        return len(self._reverse()[node.uid]) if node else 0
+
     # when we come across a link, determine how it should be added to the graph
     def add_link(self, source_url, target_url, target_metadata=None):
         # first, look up the source node
@@ -97,70 +317,135 @@ class LinkGraph:
         self.root = self.get_or_create_node(url, **kwargs)
         return self.root
 
-    # only JSON is currently supported. This just converts the nodes to dictionaries and serialises everything.
-    def serialize(self, fmt="json"):
-        if fmt == "json":
-            data = {
-                "root": self.root.url if self.root else None,
-                "nodes": {url: node.to_dict() for url, node in self._crawled.items()}
-            }
-            return json.dumps(data, indent=2)
-        raise ValueError(f"Unknown format: {fmt}")
+    # fold another graph (a LinkGraph or a MappedGraph) into this one, e.g. the shards of a distributed crawl.
+    # whichever shard actually fetched a page knows everything about it; the rest only know it's linked to
+    def merge(self, other):
+        for theirs in other.nodes():
+            fields = {f: getattr(theirs, f) for f in Node.FIELDS}
+            if theirs.response_code is None:
+                fields = {k: v for k, v in fields.items() if v}
+            node = self.get_or_create_node(theirs.url, **fields)
+            for target in other.links(theirs.url):
+                node.add_target(self.get_or_create_node(target))
+        if self.root is None and other.root is not None:
+            self.root = self._crawled[other.root.url]
+        return self
 
-    # function decorators are really great
-    @classmethod
-    def deserialize(cls, data, fmt="json"):
-        if fmt == "json":
-            graph_data = json.loads(data)
-            graph = cls()
-            # create the nodes
-            for url, node_dict in graph_data["nodes"].items():
-                graph._crawled[url] = Node.from_dict(node_dict)
+    # every node, in the order they were added (MappedGraph has these too)
+    def nodes(self):
+        return iter(self._nodes)
 
-            # resolve the links to nodes
-            for node in graph._crawled.values():
-                node.links = [graph._crawled[target_url] for target_url in getattr(node, "_link_urls", [])]
+    def node(self, url):
+        return self._crawled.get(url)
 
-            # set root
-            root_url = graph_data.get("root")
-            if root_url:
-                graph.root = graph._crawled.get(root_url)
+    # urls of everything url links to
+    def links(self, url):
+        node = self._crawled.get(url)
+        return [n.url for n in node.links] if node else []
 
-            return graph
-        raise ValueError(f"Unknown format: {fmt}")
+    # JSON is one big document (the original format); NDJSON is one node per line, so it can be read back
+    # without ever holding the whole file in memory. ccg is our own binary format (see graphfile.py), which
+    # report mode can query straight off the disk; ccgz is the same thing zstd-compressed.
+    FORMATS = ("json", "ndjson", "ccg", "ccgz")
+    BINARY_FORMATS = ("ccg", "ccgz")
 
-    @classmethod
-    def load(cls, data):
-        return cls.deserialize("".join(data))
+    # returns bytes for the binary formats, a string otherwise
+    def serialize(self, fmt="json"):
+        out = io.BytesIO() if fmt in self.BINARY_FORMATS else io.StringIO()
+        self.dump(out, fmt)
+        return out.getvalue()
 
-    # turn our site map format into standards compliant XML that you can host - why not, it's basically free
-    def generate_sitemap(self):
-        # we will eventually be using this xml plugin to permit XML reports as well but for now this is its job
-        urlset = Element("urlset", xmlns="http://www.sitemaps.org/schemas/sitemap/0.9")
+    # stream the graph to a file handle one node at a time, rather than building the whole document first
+    def dump(self, fp, fmt="json"):
+        root = self.root.url if self.root else None
+        if fmt == "json":
+            # byte-for-byte what json.dumps(..., indent=2) of the whole graph would give us
+            fp.write('{\n  "root": ' + json.dumps(root) + ',\n  "nodes": {')
+            first = True
+            for url, node in self._crawled.items():
+                fp.write("\n    " if first else ",\n    ")
+                fp.write(json.dumps(url) + ": " + json.dumps(node.to_dict(), indent=2).replace("\n", "\n    "))
+                first = False
+            fp.write("}\n}" if first else "\n  }\n}")
+        elif fmt == "ndjson":
+            # header line first, then one node per line
+            fp.write(json.dumps({"root": root}) + "\n")
+            for node in self._nodes:
+                fp.write(json.dumps(node.to_dict()) + "\n")
+        elif fmt in self.BINARY_FORMATS:
+            # fp has to be opened in binary mode for these
+            from . import graphfile
+            graphfile.write(self, fp, compress=(fmt == "ccgz"))
+        else:
+            raise ValueError(f"Unknown format: {fmt}")
 
-        for node in self._crawled.values():
-            if node.external or node.broken:
-                continue
+    # function decorators are really great
+    @classmethod
+    def deserialize(cls, data, fmt="json"):
+        return cls.read(io.BytesIO(data) if isinstance(data, bytes) else io.StringIO(data), fmt)
 
-            url_elem = SubElement(urlset, "url")
+    # build a graph from a file handle. NDJSON is read a line at a time; links are only resolved in a second
+    # pass once every node exists, since a page can link to something further down the file.
+    @classmethod
+    def read(cls, fp, fmt="json"):
+        if fmt in cls.BINARY_FORMATS:
+            from .graphfile import MappedGraph
+            return MappedGraph(fp.read()).to_graph()
+        graph = cls()
+        if fmt == "json":
+            graph_data = json.load(fp)
+            root_url = graph_data.get("root")
+            for node_dict in graph_data["nodes"].values():
+                graph._add(Node.from_dict(node_dict))
+            # let the parsed document go before the second pass
+            del graph_data
+        elif fmt == "ndjson":
+            root_url = json.loads(fp.readline() or "{}").get("root")
+            for line in fp:
+                if line.strip():
+                    graph._add(Node.from_dict(json.loads(line)))
+        else:
+            raise ValueError(f"Unknown format: {fmt}")
 
-            loc = SubElement(url_elem, "loc")
-            loc.text = node.url
+        # resolve the links to nodes
+        for node in graph._nodes:
+            node.links = [graph._crawled[target_url] for target_url in node._link_urls or []]
+            node._link_urls = None
 
-            if node.last_modified:
-                lastmod = SubElement(url_elem, "lastmod")
-                try:
-                    # attempt to parse and reformat timestamp if valid
-                    dt = datetime.datetime.fromisoformat(node.last_modified)
-                    lastmod.text = dt.date().isoformat()
-                except Exception:  
-                    # fallback: raw string
-                    lastmod.text = node.last_modified
+        # set root
+        if root_url:
+            graph.root = graph._crawled.get(root_url)
+        return graph
 
-        # prettify it a little bit
-        raw_xml = tostring(urlset, encoding="utf-8")
-        dom = xml.dom.minidom.parseString(raw_xml)
-        return dom.toprettyxml(indent="  ")
+    # data is either an open file, the bytes of a binary graph, or the lines/text of a JSON graph
+    @classmethod
+    def load(cls, data, fmt="json"):
+        if hasattr(data, "read"):
+            return cls.read(data, fmt)
+        if isinstance(data, bytes):
+            return cls.deserialize(data, fmt)
+        return cls.deserialize("".join(data), fmt)
 
+    # work out the format from a file name
+    @classmethod
+    def format_of(cls, path):
+        suffix = str(path).rsplit(".", 1)[-1].lower()
+        return suffix if suffix in cls.FORMATS else "json"
 
+    # turn our site map format into standards compliant XML that you can host - why not, it's basically free.
+    # written straight into directory, split into several files if the site is big enough to need it
+    def write_sitemap(self, directory, compress=False):
+        # imported here since its xml and date handling take a while to load, and most runs never write a sitemap
+        from . import sitemap
+        files = sitemap.write_sitemap(self, directory, compress)
+        for name in files:
+            Logger.print(1, f"{Path(directory) / name} written")
+        return files
 
+    # the same sitemap as one xml string, never split up
+    def generate_sitemap(self):
+        import tempfile
+        from . import sitemap
+        with tempfile.TemporaryDirectory() as tmp:
+            sitemap.write_sitemap(self, tmp, max_urls=float("inf"), max_bytes=float("inf"))
+            return (Path(tmp) / "sitemap.xml").read_text(encoding="utf-8")
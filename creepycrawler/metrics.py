@@ -0,0 +1,208 @@
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+
+class Counter:
+    # a running total, optionally split up by a label (e.g. one count per status code)
+    def __init__(self, name, help, label_name=None):
+        self.name = name
+        self.help = help
+        self.label_name = label_name
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, label=None):
+        with self._lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    # a copy of (label, value) pairs. fetch threads can add a label at any moment, and iterating the dict itself
+    # while that happens blows up
+    def items(self):
+        with self._lock:
+            return list(self.values.items())
+
+    @property
+    def total(self):
+        return sum(v for _, v in self.items())
+
+
+class Gauge:
+    # a value that goes up and down, like the length of the queue
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    # how a value is distributed, in fixed buckets (cumulative, like prometheus wants them), plus a count and a sum
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    # roughly where the q-th quantile falls: the upper edge of the bucket it lands in
+    def quantile(self, q):
+        if not self.count:
+            return None
+        seen = 0
+        for edge, n in zip(self.buckets + [float("inf")], self.counts):
+            seen += n
+            if seen >= q * self.count:
+                return edge
+        return float("inf")
+
+
+class Metrics:
+    """
+    Everything we count while crawling. The crawler only touches this if it was given one, so a crawl without
+    metrics pays nothing for them. Sinks get a snapshot every interval seconds (and one last one at the end):
+    a progress line, a JSON lines file, a Prometheus text file - anything with emit(metrics) and close().
+    """
+    SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    BYTES = (1_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 10_000_000)
+
+    def __init__(self, sinks=(), interval=5):
+        self.started = time.monotonic()
+        self.pages = Counter("pages_total", "Pages added to the graph")
+        self.responses = Counter("responses_total", "Responses by status code", label_name="code")
+        self.fetch_seconds = Histogram("fetch_seconds", "Time from sending a request to having the body", self.SECONDS)
+        self.parse_seconds = Histogram("parse_seconds", "Time spent parsing html and css, including waiting for a parser", self.SECONDS)
+        self.response_bytes = Histogram("response_bytes", "Size of the bodies we read", self.BYTES)
+        self.queue_depth = Gauge("queue_depth", "Urls waiting in the frontier")
+        self.in_flight = Gauge("in_flight", "Requests being worked on")
+        self.sinks = list(sinks)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def all(self):
+        return [self.pages, self.responses, self.fetch_seconds, self.parse_seconds, self.response_bytes, self.queue_depth, self.in_flight]
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def pages_per_second(self):
+        elapsed = self.elapsed()
+        return self.pages.total / elapsed if elapsed else 0
+
+    def snapshot(self):
+        out = {"elapsed": round(self.elapsed(), 3), "pages_per_second": round(self.pages_per_second(), 2)}
+        for metric in self.all():
+            if isinstance(metric, Counter):
+                out[metric.name] = {str(k): v for k, v in metric.items()} if metric.label_name else metric.total
+            elif isinstance(metric, Gauge):
+                out[metric.name] = metric.value
+            else:
+                out[metric.name] = {"count": metric.count, "sum": round(metric.sum, 6),
+                                    "p50": metric.quantile(0.5), "p90": metric.quantile(0.9), "p99": metric.quantile(0.99)}
+        return out
+
+    def start(self):
+        self.started = time.monotonic()
+        if self.sinks:
+            self._thread = threading.Thread(target=self._report, name="metrics", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for sink in self.sinks:
+            sink.emit(self)
+            sink.close()
+
+    def _report(self):
+        while not self._stop.wait(self.interval):
+            for sink in self.sinks:
+                sink.emit(self)
+
+
+class ProgressSink:
+    # one line on stderr, rewritten in place
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+
+    def emit(self, metrics):
+        codes = {}
+        for code, n in metrics.responses.items():
+            group = f"{str(code)[0]}xx" if str(code).isdigit() else str(code)
+            codes[group] = codes.get(group, 0) + n
+        mix = " ".join(f"{group}:{n}" for group, n in sorted(codes.items()))
+        p50 = metrics.fetch_seconds.quantile(0.5)
+        latency = f"fetch p50 <{p50 * 1000:.0f}ms" if p50 not in (None, float("inf")) else "fetch p50 -"
+        self.stream.write(f"\r{metrics.pages.total} pages ({metrics.pages_per_second():.1f}/s), "
+                          f"{metrics.queue_depth.value} queued, {metrics.in_flight.value} in flight, {latency}, {mix}\033[K")
+        self.stream.flush()
+
+    def close(self):
+        self.stream.write("\n")
+
+
+class JsonLinesSink:
+    # one snapshot per line, so a crawl can be graphed afterwards
+    def __init__(self, path):
+        self.path = Path(path)
+        os.makedirs(self.path.parent, exist_ok=True)
+        self._fp = open(self.path, "a")
+
+    def emit(self, metrics):
+        self._fp.write(json.dumps({"time": time.time(), **metrics.snapshot()}) + "\n")
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+
+class PrometheusSink:
+    # the text exposition format, rewritten in full every time (for node_exporter's textfile collector, say)
+    def __init__(self, path, prefix="creepycrawler_"):
+        self.path = Path(path)
+        self.prefix = prefix
+
+    def emit(self, metrics):
+        lines = []
+        for metric in metrics.all():
+            name = self.prefix + metric.name
+            kind = "counter" if isinstance(metric, Counter) else "gauge" if isinstance(metric, Gauge) else "histogram"
+            lines += [f"# HELP {name} {metric.help}", f"# TYPE {name} {kind}"]
+            if isinstance(metric, Counter):
+                for label, value in sorted(metric.items(), key=lambda kv: str(kv[0])):
+                    lines.append(f'{name}{{{metric.label_name}="{label}"}} {value}' if label is not None else f"{name} {value}")
+            elif isinstance(metric, Gauge):
+                lines.append(f"{name} {metric.value}")
+            else:
+                running = 0
+                for edge, n in zip(metric.buckets, metric.counts):
+                    running += n
+                    lines.append(f'{name}_bucket{{le="{edge}"}} {running}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {metric.count}')
+                lines.append(f"{name}_sum {metric.sum}")
+                lines.append(f"{name}_count {metric.count}")
+        os.makedirs(self.path.parent, exist_ok=True)
+        # the collector may read it at any moment, so it only ever gets to see a finished file
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.path)
+
+    def close(self):
+        pass
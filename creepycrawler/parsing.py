@@ -0,0 +1,130 @@
+import re
+from urllib.parse import urljoin, urldefrag
+from bs4 import BeautifulSoup
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# every tag that can point at another resource, and the attribute(s) holding the link
+LINK_ATTRS = {
+    'a': ('href',),
+    'link': ('href',),
+    'script': ('src',),
+    'img': ('src', 'srcset'),
+    'iframe': ('src',),
+    'source': ('src', 'srcset'),
+}
+PARSERS = ('html.parser', 'lxml')
+
+# i'll be honest, I got this from stackoverflow. it's a very impressive regex.
+CSS_URL = re.compile(r'url\(\s*[\'"]?([^\'")]+)[\'"]?\s*\)', re.IGNORECASE)
+
+
+def normalize_url(url):
+    # remove #fragment
+    base, _ = urldefrag(url)
+    return base
+
+
+def parse_css(css_text, base_url):
+    return {normalize_url(urljoin(base_url, match)) for match in CSS_URL.findall(css_text)}
+
+
+# returns (title, set of links). the parser is either BeautifulSoup's html.parser, or lxml for speed
+def parse_html(html, base, parser='html.parser'):
+    collector = _LinkCollector()
+    if parser == 'lxml':
+        # lxml calls straight into the collector as it tokenizes, so no tree ever gets built
+        lxml_parser = etree.HTMLParser(target=collector)
+        try:
+            lxml_parser.feed(html)
+            lxml_parser.close()
+        except etree.LxmlError:
+            # libxml2 gives up on some truly mangled (or empty) pages; keep whatever we got before it did
+            pass
+    else:
+        # what a fun name
+        soup = BeautifulSoup(html, 'html.parser')
+        # one walk over every tag, instead of one find_all per tag type
+        for el in soup.find_all(True):
+            collector.start(el.name, el.attrs)
+            if el.name == 'style':
+                collector.style_text.append(el.get_text())
+        collector.title = soup.title.string if soup.title else None
+    return collector.result(base)
+
+
+# one entry point for whatever we downloaded, so it can be shipped off to a parser process as-is.
+# returns (title, links); title is None for anything that isn't html
+def parse_document(content_type, text, base, parser='html.parser'):
+    # if it's an html document, pick it apart for links we can poach
+    if 'text/html' in content_type:
+        return parse_html(text, base, parser)
+    if 'text/css' in content_type:
+        return None, parse_css(text, base)
+    return None, set()
+
+
+def _srcset_urls(srcset):
+    # srcset looks like "small.jpg 480w, big.jpg 1080w" - we only care about the first word of each candidate
+    return [candidate.split()[0] for candidate in srcset.split(',') if candidate.strip()]
+
+
+class _LinkCollector:
+    # gathers raw link values as tags go by; they only get resolved at the end, once we know about any <base href>
+    def __init__(self):
+        self.raw = []
+        self.style_text = []
+        self.base = None
+        self.title = None
+        self._title_parts = None
+        self._in_style = False
+
+    def start(self, tag, attrib):
+        if tag == 'base' and self.base is None and attrib.get('href'):
+            self.base = attrib['href']
+        elif tag == 'title' and self.title is None:
+            self._title_parts = []
+        elif tag == 'style':
+            self._in_style = True
+
+        for attr in LINK_ATTRS.get(tag, ()):
+            raw = attrib.get(attr)
+            if not raw:
+                continue
+            if attr == 'srcset':
+                self.raw.extend(_srcset_urls(raw))
+            else:
+                self.raw.append(raw)
+
+        # inline style="background: url(...)"
+        style = attrib.get('style')
+        if style and 'url(' in style.lower():
+            self.style_text.append(style)
+
+    def end(self, tag):
+        if tag == 'title' and self._title_parts is not None:
+            self.title = "".join(self._title_parts)
+            self._title_parts = None
+        elif tag == 'style':
+            self._in_style = False
+
+    def data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+        elif self._in_style:
+            self.style_text.append(data)
+
+    def close(self):
+        return self
+
+    def result(self, base):
+        # a <base href> changes what every relative link on the page is relative to
+        if self.base:
+            base = urljoin(base, self.base)
+        links = {normalize_url(urljoin(base, raw.strip())) for raw in self.raw}
+        for css in self.style_text:
+            links |= parse_css(css, base)
+        title = self.title.strip() if self.title else ''
+        return title, links
@@ -1,8 +1,238 @@
+import io
 import json
+from collections import deque
+from contextlib import ExitStack
+from urllib.parse import unquote
 from .helpers import Logger
+
+# which sections go in which report. "all" means every report, each in its own file
+REPORTS = {
+    "deadlinks": ("broken", "redirects"),
+    "unreachable": ("unreachable_pages", "unreachable_files", "changed_files"),
+    "combined": ("broken", "redirects", "unreachable_pages", "unreachable_files", "changed_files"),
+}
+SECTIONS = REPORTS["combined"]
+# what each entry of a list gets called in xml
+LIST_TAGS = {"referrers": "referrer", "chain": "hop"}
+TITLES = {
+    "broken": "Broken links",
+    "redirects": "Redirects",
+    "unreachable_pages": "Pages not reachable from the root",
+    "unreachable_files": "Files in the webroot that no page links to",
+    "changed_files": "Files changed since the last inventory",
+}
+
+
 class Reporting:
-    def generate(link_graph, file_tree=None, frtype=None, fmt="json"):
-        print("files in webroot that were not found in live crawl:")
-        diff=file_tree.compare(link_graph)
-        #Logger.print(2, diff)
-        return json.dumps(diff);
+    """
+    Works out everything the reports need in one walk over the graph, starting from the root: which pages can be
+    reached at all, which links are broken (and who links to them), where redirects lead, and which files in the
+    webroot nothing reachable serves. Every requested report then gets written in every requested format at once,
+    section by section, straight to its file.
+    Works on a LinkGraph or a MappedGraph; all it needs is nodes(), node(), links(), inbound() and root.
+    """
+    def __init__(self, link_graph, file_tree=None):
+        self.graph = link_graph
+        self.file_tree = file_tree
+        self._sections = None
+
+    # the old one-report-at-a-time interface; returns the report as a string. that means one report, so not "all"
+    @staticmethod
+    def generate(link_graph, file_tree=None, frtype="combined", fmt="json"):
+        if frtype not in REPORTS:
+            raise ValueError(f"generate makes one report at a time, one of {', '.join(REPORTS)}; not {frtype!r}")
+        out = io.StringIO()
+        Reporting(link_graph, file_tree).write([frtype], [fmt], lambda name, mode: _Borrowed(out))
+        return out.getvalue()
+
+    # open(name, mode) is anything that gives back a context manager around a text file, like RWTool.open
+    def write(self, report_types, formats, open):
+        if "all" in report_types:
+            report_types = list(REPORTS)
+        sections = self.analyze()
+        with ExitStack() as stack:
+            writers = []
+            for rtype in report_types:
+                for fmt in formats:
+                    fp = stack.enter_context(open(f"{rtype}.{fmt}", "w"))
+                    writer = WRITERS[fmt](fp, rtype)
+                    writer.begin()
+                    writers.append((writer, REPORTS[rtype]))
+            # one section at a time, handed to every writer that wants it
+            for name in SECTIONS:
+                items = sections.get(name)
+                if items is None:
+                    continue
+                for writer, wanted in writers:
+                    if name in wanted:
+                        writer.section(name, items)
+            for writer, _ in writers:
+                writer.end()
+
+    def analyze(self):
+        if self._sections is not None:
+            return self._sections
+        graph = self.graph
+        reached = set()
+        served = set()
+        broken, redirects = [], []
+        root = graph.root
+
+        # breadth first from the root, noting everything interesting about each node as we reach it
+        queue = deque([root.url] if root else [])
+        reached.update(queue)
+        while queue:
+            url = queue.popleft()
+            node = graph.node(url)
+            if node.broken:
+                broken.append({"url": url, "response_code": node.response_code, "external": node.external,
+                               "archive": node.archive, "referrers": [n.url for n in graph.inbound(url)]})
+            elif node.redirect:
+                redirects.append(self._chain(node))
+            elif node.file_path and not node.external:
+                served.add(unquote(node.file_path))
+            # don't wander off into other sites
+            if node.external:
+                continue
+            for target in graph.links(url):
+                if target not in reached:
+                    reached.add(target)
+                    queue.append(target)
+
+        sections = {
+            "broken": broken,
+            "redirects": redirects,
+            # anything internal the crawl knows about but can't get to from the root (e.g. only linked from a redirect loop)
+            "unreachable_pages": [n.url for n in graph.nodes() if n.url not in reached and not n.external],
+        }
+        if self.file_tree:
+            sections["unreachable_files"] = sorted(self.file_tree.unmatched(served))
+            if self.file_tree.hash_files:
+                sections["changed_files"] = sorted(self.file_tree.changed)
+        Logger.print(1, f"{len(reached)} urls reachable from the root, {len(broken)} broken, {len(redirects)} redirects")
+        self._sections = sections
+        return sections
+
+    # where a redirect ends up, and whether it goes round in circles on the way
+    def _chain(self, node):
+        chain = [node.url]
+        loop = False
+        while node and node.redirect:
+            if node.redirect in chain:
+                loop = True
+                break
+            chain.append(node.redirect)
+            node = self.graph.node(node.redirect)
+        return {"url": chain[0], "chain": chain, "final": chain[-1], "hops": len(chain) - 1, "loop": loop,
+                "referrers": [n.url for n in self.graph.inbound(chain[0])]}
+
+
+class _Borrowed:
+    # lets a writer use a file handle that someone else will close
+    def __init__(self, fp):
+        self.fp = fp
+
+    def __enter__(self):
+        return self.fp
+
+    def __exit__(self, *exc):
+        return False
+
+
+class JsonWriter:
+    # one JSON object, one key per section, written an item at a time
+    def __init__(self, fp, report):
+        self.fp = fp
+        self.report = report
+
+    def begin(self):
+        self.fp.write('{\n  "report": ' + json.dumps(self.report))
+
+    def section(self, name, items):
+        self.fp.write(f',\n  {json.dumps(name)}: [')
+        for i, item in enumerate(items):
+            self.fp.write(("\n    " if i == 0 else ",\n    ") + json.dumps(item))
+        self.fp.write("\n  ]" if items else "]")
+
+    def end(self):
+        self.fp.write("\n}\n")
+
+
+class NdjsonWriter:
+    # one line per item, tagged with its section
+    def __init__(self, fp, report):
+        self.fp = fp
+        self.report = report
+
+    def begin(self):
+        pass
+
+    def section(self, name, items):
+        for item in items:
+            self.fp.write(json.dumps({"section": name, **(item if isinstance(item, dict) else {"value": item})}) + "\n")
+
+    def end(self):
+        pass
+
+
+class XmlWriter:
+    def __init__(self, fp, report):
+        self.fp = fp
+        self.report = report
+
+    def begin(self):
+        from xml.sax.saxutils import quoteattr
+        self.fp.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<report type={quoteattr(self.report)}>\n')
+
+    def section(self, name, items):
+        # xml.sax pulls in half of urllib when it loads, so only reports that are actually xml pay for it
+        from xml.sax.saxutils import escape, quoteattr
+        self.fp.write(f'  <{name} count="{len(items)}">\n')
+        for item in items:
+            if not isinstance(item, dict):
+                self.fp.write(f"    <item>{escape(item)}</item>\n")
+                continue
+            attrs = " ".join(f"{k}={quoteattr(json.dumps(v) if isinstance(v, bool) else str(v))}"
+                             for k, v in item.items() if not isinstance(v, list) and v is not None)
+            self.fp.write(f"    <item {attrs}>\n")
+            for key, values in item.items():
+                if isinstance(values, list):
+                    tag = LIST_TAGS.get(key, key)
+                    for value in values:
+                        self.fp.write(f"      <{tag}>{escape(value)}</{tag}>\n")
+            self.fp.write("    </item>\n")
+        self.fp.write(f"  </{name}>\n")
+
+    def end(self):
+        self.fp.write("</report>\n")
+
+
+class MarkdownWriter:
+    def __init__(self, fp, report):
+        self.fp = fp
+        self.report = report
+
+    def begin(self):
+        self.fp.write(f"# {self.report.capitalize()} report\n")
+
+    def section(self, name, items):
+        self.fp.write(f"\n## {TITLES[name]} ({len(items)})\n\n")
+        if not items:
+            self.fp.write("None!\n")
+        for item in items:
+            if not isinstance(item, dict):
+                self.fp.write(f"- `{item}`\n")
+            elif name == "broken":
+                archived = f", archived at <{item['archive']}>" if item["archive"] else ""
+                self.fp.write(f"- <{item['url']}> ({item['response_code']}){archived}, linked from:\n")
+                for ref in item["referrers"]:
+                    self.fp.write(f"  - <{ref}>\n")
+            else:
+                note = " (loop!)" if item["loop"] else ""
+                self.fp.write(f"- <{item['url']}> → <{item['final']}>, {item['hops']} hop(s){note}\n")
+
+    def end(self):
+        pass
+
+
+WRITERS = {"json": JsonWriter, "ndjson": NdjsonWriter, "xml": XmlWriter, "md": MarkdownWriter}
@@ -0,0 +1,197 @@
+import time
+import email.utils
+from collections import deque
+from threading import Lock
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+import requests
+from .helpers import Logger
+
+
+class TokenBucket:
+    """
+    Classic token bucket, shared between threads. rate=None means no limit at all.
+    Callers reserve a token up front (going into debt if need be) and then sleep off the debt outside the lock,
+    so a crowd of threads ends up evenly spaced rather than all waking at once.
+    """
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._stamp = time.monotonic()
+        self._paused_until = 0
+        self._lock = Lock()
+
+    def take(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0, self._paused_until - now)
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.rate)
+            self._stamp = now
+        if wait > 0:
+            time.sleep(wait)
+
+    # nobody gets a token until this many seconds from now
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class HostScheduler:
+    """
+    Sits between the frontier and the fetcher and keeps us polite, one host at a time:
+    - robots.txt is fetched once per host and consulted before anything gets queued for download
+    - requests to each host go through a token bucket, starting at max_rate (None = as fast as we can)
+      and slowed down further by any Crawl-delay / Request-rate in robots.txt
+    - a 429 or 503 pauses the host for its Retry-After and halves the rate. a run of other 5xx errors halves
+      it too, since that's usually the origin struggling. every 20 clean responses in a row earn 10% back.
+      with lots of requests in flight, one overloaded moment comes back as a whole burst of throttles, so the
+      rate is halved at most once per SLOWDOWN_WINDOW seconds (or per Retry-After, if that's longer)
+    """
+    THROTTLE_CODES = {429, 503}
+    ERROR_STREAK = 5
+    RECOVER_AFTER = 20
+    SLOWDOWN_WINDOW = 2
+
+    def __init__(self, session, max_rate=None, respect_robots=True, max_retries=3, min_rate=0.5):
+        self.session = session
+        self.max_rate = max_rate
+        self.respect_robots = respect_robots
+        self.max_retries = max_retries
+        self.min_rate = min_rate
+        self.user_agent = session.headers['User-Agent']
+        self._hosts = {}
+        self._lock = Lock()
+
+    # is robots.txt ok with us fetching this url?
+    def allowed(self, url):
+        if not self.respect_robots:
+            return True
+        host = self._host(url)
+        return host.robots is None or host.robots.can_fetch(self.user_agent, url)
+
+    # call before every request; blocks until the host is ready for another one
+    def wait(self, url):
+        host = self._host(url)
+        host.bucket.take()
+        host.recent.append(time.monotonic())
+
+    # call after every response. returns True if the request should be tried again
+    def feedback(self, url, code, headers):
+        host = self._host(url)
+        if code in self.THROTTLE_CODES:
+            delay = self._retry_after(headers.get('Retry-After'))
+            if delay:
+                Logger.print(1, f"{host.name} asked us to back off for {delay:.0f}s")
+                host.bucket.pause(delay)
+            self._slow_down(host, window=max(self.SLOWDOWN_WINDOW, delay or 0))
+            return True
+        if code >= 500:
+            host.clean = 0
+            host.errors += 1
+            if host.errors >= self.ERROR_STREAK:
+                self._slow_down(host)
+            return False
+        host.errors = 0
+        host.clean += 1
+        if host.clean >= self.RECOVER_AFTER:
+            self._speed_up(host)
+        return False
+
+    def _host(self, url):
+        name = urlparse(url).netloc.lower()
+        with self._lock:
+            host = self._hosts.get(name)
+            if host is None:
+                host = self._hosts[name] = _Host(name, TokenBucket(self.max_rate))
+        # only one thread goes and gets robots.txt; anyone else asking about the host waits for it
+        with host.lock:
+            if not host.ready:
+                if self.respect_robots:
+                    self._load_robots(host, url)
+                host.ready = True
+        return host
+
+    def _load_robots(self, host, url):
+        parsed = urlparse(url)
+        robots_url = f"{parsed.scheme}://{parsed.netloc}/robots.txt"
+        try:
+            response = self.session.get(robots_url, stream=True)
+            text, _ = self.session.read_text(response, 500_000)
+        except requests.exceptions.RequestException as e:
+            Logger.print(1, f"Couldn't fetch {robots_url} ({e}); assuming everything is allowed")
+            return
+        # no robots.txt (or a broken one) means no rules
+        if response.status_code >= 400:
+            return
+        host.robots = RobotFileParser(robots_url)
+        host.robots.parse(text.splitlines())
+
+        # the site gets a say in how fast we go, but only to slow us down
+        delay = host.robots.crawl_delay(self.user_agent)
+        rate = host.robots.request_rate(self.user_agent)
+        limits = [r for r in (1 / float(delay) if delay else None,
+                              rate.requests / rate.seconds if rate else None,
+                              self.max_rate) if r]
+        if limits:
+            host.bucket.rate = host.ceiling = min(limits)
+            Logger.print(1, f"Crawling {host.name} at no more than {host.ceiling:.2f} requests/second")
+
+    def _slow_down(self, host, window=SLOWDOWN_WINDOW):
+        with host.lock:
+            host.clean = 0
+            host.errors = 0
+            # the rest of a burst is about the same moment we've already reacted to
+            now = time.monotonic()
+            if now - host.last_slowdown < window:
+                return
+            host.last_slowdown = now
+            current = host.bucket.rate or host.observed_rate()
+            host.bucket.rate = max(self.min_rate, current / 2)
+        Logger.print(2, f"Slowing down to {host.bucket.rate:.2f} requests/second on {host.name}")
+
+    def _speed_up(self, host):
+        host.clean = 0
+        if host.bucket.rate is None:
+            return
+        rate = host.bucket.rate * 1.1
+        # never faster than robots.txt or --rate-limit allow
+        host.bucket.rate = min(rate, host.ceiling) if host.ceiling else rate
+
+    def _retry_after(self, value):
+        # either a number of seconds or an http date
+        if not value:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0, when.timestamp() - time.time())
+
+
+class _Host:
+    def __init__(self, name, bucket):
+        self.name = name
+        self.bucket = bucket
+        self.ceiling = bucket.rate
+        self.robots = None
+        self.ready = False
+        self.clean = 0
+        self.errors = 0
+        # when we last halved the rate
+        self.last_slowdown = float("-inf")
+        self.lock = Lock()
+        # when the last few requests went out
+        self.recent = deque(maxlen=50)
+
+    # how fast we've actually been going, for when we need to halve a rate that was never set
+    def observed_rate(self):
+        if len(self.recent) < 2 or self.recent[-1] == self.recent[0]:
+            return 1
+        return (len(self.recent) - 1) / (self.recent[-1] - self.recent[0])
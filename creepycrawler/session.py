@@ -0,0 +1,169 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from .helpers import Logger
+
+
+class Session:
+    """
+    One shared connection pool for the whole crawl. Connections to each host are kept alive between requests,
+    we ask for every compression scheme we can actually decode, and we keep count of how often a connection
+    got reused so we can brag about it at the end.
+    If http2 is requested and httpx is installed, requests are sent through httpx instead; otherwise we fall
+    back to plain old keep-alive HTTP/1.1.
+    """
+    # how many hosts urllib3 keeps a pool for. past that the least recently used host's pool (and its kept-alive
+    # connections) gets thrown away, so this wants to be well above the handful of hosts a crawl talks to at once:
+    # the site, robots.txt, the archive, and whatever the external link check is busy with
+    POOL_HOSTS = 100
+
+    def __init__(self, pool_size=10, http2=False, timeout=10, user_agent='creepy-crawler'):
+        self.timeout = timeout
+        self.headers = {
+            'User-Agent': user_agent,
+            # urllib3 only advertises the encodings it has a decoder for (br/zstd show up if those libraries are installed)
+            'Accept-Encoding': ACCEPT_ENCODING,
+        }
+        self.http2 = False
+        self._requests = 0
+        self._versions = {}
+        self._body_bytes = 0
+        self._skipped = 0
+        # a Metrics to report body sizes to, if anyone's counting
+        self.metrics = None
+
+        if http2:
+            try:
+                import httpx
+                self._client = httpx.Client(
+                    http2=True,
+                    headers=self.headers,
+                    timeout=timeout,
+                    follow_redirects=True,
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                )
+                self._httpx = httpx
+                self.http2 = True
+                return
+            except ImportError:
+                Logger.print(1, "HTTP/2 needs httpx (pip install httpx[http2]); falling back to HTTP/1.1.")
+
+        self._client = requests.Session()
+        self._client.headers.update(self.headers)
+        # pool_connections is the number of per-host pools, pool_maxsize how many connections each one keeps alive
+        self._adapter = HTTPAdapter(pool_connections=self.POOL_HOSTS, pool_maxsize=pool_size)
+        self._client.mount('http://', self._adapter)
+        self._client.mount('https://', self._adapter)
+
+    # with stream=True we only wait for the headers; the body is left on the wire until read_text or discard
+    def get(self, url, headers=None, stream=False):
+        return self.request("GET", url, headers=headers, stream=stream)
+
+    def head(self, url, headers=None):
+        return self.request("HEAD", url, headers=headers)
+
+    def request(self, method, url, headers=None, stream=False):
+        self._requests += 1
+        if not self.http2:
+            # requests doesn't follow redirects for HEAD unless you ask it to
+            return self._client.request(method, url, timeout=self.timeout, headers=headers, stream=stream, allow_redirects=True)
+        try:
+            request = self._client.build_request(method, url, headers=headers)
+            response = _Http2Response(self._client.send(request, stream=stream), self._httpx)
+        except self._httpx.HTTPError as e:
+            # so callers only ever have to deal with one family of exceptions
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        self._versions[response.http_version] = self._versions.get(response.http_version, 0) + 1
+        return response
+
+    # read a streamed body as text, giving up after limit bytes (if there is a limit). returns (text, truncated)
+    def read_text(self, response, limit=None):
+        chunks = []
+        size = 0
+        truncated = False
+        for chunk in response.iter_content(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if limit and size > limit:
+                truncated = True
+                break
+        self._body_bytes += size
+        if self.metrics:
+            self.metrics.response_bytes.observe(size)
+        # hanging up is the only way to stop the rest of a body from arriving
+        response.close()
+        body = b"".join(chunks)
+        if truncated:
+            body = body[:limit]
+        try:
+            return body.decode(response.encoding or 'utf-8', errors='replace'), truncated
+        except LookupError:
+            # a charset python has never heard of. requests' .text falls back on utf-8 for those too
+            return body.decode('utf-8', errors='replace'), truncated
+
+    # we don't want the body at all. small ones are cheaper to read and throw away than to reconnect,
+    # anything bigger (or of unknown size) gets the connection closed on it
+    def discard(self, response, drain_limit=64 * 1024):
+        self._skipped += 1
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) <= drain_limit:
+            for _ in response.iter_content(drain_limit):
+                pass
+            self._body_bytes += int(length)
+        response.close()
+
+    # a one-line summary of how well the pool did
+    def stats(self):
+        if self.http2:
+            versions = ", ".join(f"{n} over {v}" for v, n in sorted(self._versions.items()))
+            return f"{self._requests} requests ({versions or 'none completed'}), {self._bodies()}"
+
+        # urllib3 keeps a pool per host; each one knows how many connections it had to open
+        pools = self._adapter.poolmanager.pools
+        connections = requests_sent = 0
+        for key in pools.keys():
+            pool = pools[key]
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+        reused = requests_sent - connections
+        rate = (100 * reused / requests_sent) if requests_sent else 0
+        return f"{requests_sent} requests over {connections} connections ({rate:.1f}% reused), {self._bodies()}"
+
+    def _bodies(self):
+        return f"{self._body_bytes / 1e6:.1f} MB of bodies read, {self._skipped} not downloaded"
+
+    def close(self):
+        self._client.close()
+
+
+class _Http2Response:
+    # just enough of requests.Response for the crawler to not care which client did the work
+    def __init__(self, response, httpx):
+        self._response = response
+        self._httpx = httpx
+        self.url = str(response.url)
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.encoding = response.encoding
+        self.http_version = response.http_version
+        self.history = [_Http2Response(r, httpx) for r in response.history]
+
+    @property
+    def text(self):
+        return self._response.text
+
+    @property
+    def content(self):
+        return self._response.content
+
+    def json(self):
+        return self._response.json()
+
+    def iter_content(self, chunk_size):
+        try:
+            yield from self._response.iter_bytes(chunk_size)
+        except self._httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+    def close(self):
+        self._response.close()
@@ -0,0 +1,124 @@
+import datetime
+import email.utils
+import gzip
+import os
+from pathlib import Path
+from urllib.parse import urljoin
+from xml.sax.saxutils import escape
+
+XMLNS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+# sitemaps want W3C dates; servers hand us RFC 1123 ("Wed, 21 Oct 2015 07:28:00 GMT"), but be forgiving
+def lastmod(value):
+    if not value:
+        return None
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            dt = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            # a lastmod that isn't a date makes the whole file invalid, so better to leave it out
+            return None
+    return dt.date().isoformat()
+
+
+class SitemapWriter:
+    """
+    Writes <url> entries straight to disk as they come, starting a new sitemap-N.xml(.gz) whenever the current
+    one would go over the protocol's limits (50,000 urls or 50 MB uncompressed). If everything fit in one file
+    it ends up as plain sitemap.xml; otherwise sitemap.xml is a sitemapindex pointing at the pieces.
+    base_url is where the files will be hosted, since the index has to use absolute urls.
+    """
+    MAX_URLS = 50_000
+    MAX_BYTES = 50 * 1024 * 1024
+
+    def __init__(self, directory, base_url, compress=False, max_urls=MAX_URLS, max_bytes=MAX_BYTES):
+        self.directory = Path(directory)
+        self.base_url = base_url
+        self.compress = compress
+        self.max_urls = max_urls
+        self.max_bytes = max_bytes
+        self.files = []
+        self._fp = None
+        self._count = 0
+        self._bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, loc, modified=None):
+        entry = f"  <url>\n    <loc>{escape(loc)}</loc>\n"
+        if modified:
+            entry += f"    <lastmod>{modified}</lastmod>\n"
+        entry = (entry + "  </url>\n").encode("utf-8")
+        # leave room for the closing tag
+        if self._fp is None or self._count >= self.max_urls or self._bytes + len(entry) + len(b"</urlset>\n") > self.max_bytes:
+            self._next_file()
+        self._fp.write(entry)
+        self._count += 1
+        self._bytes += len(entry)
+
+    # returns the names of everything written, index first
+    def close(self):
+        if self._fp is None:
+            # an empty sitemap is still a valid one
+            self._next_file()
+        self._finish_file()
+        suffix = ".xml.gz" if self.compress else ".xml"
+        if len(self.files) == 1:
+            name = "sitemap" + suffix
+            os.replace(self.directory / self.files[0], self.directory / name)
+            self.files = [name]
+        else:
+            self._write_index("sitemap" + suffix)
+        return self.files
+
+    def _open(self, name):
+        path = self.directory / name
+        return gzip.open(path, "wb") if self.compress else open(path, "wb")
+
+    def _next_file(self):
+        if self._fp:
+            self._finish_file()
+        name = f"sitemap-{len(self.files) + 1}.xml" + (".gz" if self.compress else "")
+        self.files.append(name)
+        self._fp = self._open(name)
+        start = (HEADER + f'<urlset xmlns="{XMLNS}">\n').encode("utf-8")
+        self._fp.write(start)
+        self._count = 0
+        self._bytes = len(start)
+
+    def _finish_file(self):
+        self._fp.write(b"</urlset>\n")
+        self._fp.close()
+        self._fp = None
+
+    def _write_index(self, name):
+        today = datetime.date.today().isoformat()
+        with self._open(name) as f:
+            f.write((HEADER + f'<sitemapindex xmlns="{XMLNS}">\n').encode("utf-8"))
+            for shard in self.files:
+                loc = escape(urljoin(self.base_url, shard))
+                f.write(f"  <sitemap>\n    <loc>{loc}</loc>\n    <lastmod>{today}</lastmod>\n  </sitemap>\n".encode("utf-8"))
+            f.write(b"</sitemapindex>\n")
+        self.files.insert(0, name)
+
+
+# every page we fetched from the site that came back 2xx goes in: nothing external, nothing broken, no duplicates,
+# no redirect hops and nothing we only know about because something linked to it
+def write_sitemap(graph, directory, compress=False, **limits):
+    base_url = graph.root.url if graph.root else ""
+    with SitemapWriter(directory, base_url, compress, **limits) as writer:
+        for node in graph.nodes():
+            if node.external or node.broken or node.alias_of or node.redirect:
+                continue
+            if node.response_code is None or not 200 <= node.response_code < 300:
+                continue
+            writer.add(node.url, lastmod(node.last_modified))
+    return writer.files
@@ -0,0 +1,80 @@
+import re
+from collections import Counter
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, unquote_plus
+
+
+class UrlCanonicalizer:
+    """
+    Rewrites urls so the many spellings of one page come out the same: query parameters whose names match
+    strip_params are dropped (session ids, tracking tags), as are matching ;name=value path parameters
+    (;jsessionid=...), and with sort_params the rest of the query is put in order.
+    """
+    def __init__(self, strip_params=None, sort_params=False):
+        self.strip_params = re.compile(strip_params, re.IGNORECASE) if strip_params else None
+        self.sort_params = sort_params
+
+    def __call__(self, url):
+        parsed = urlsplit(url)
+        path, query = parsed.path, parsed.query
+        if self.strip_params and ';' in path:
+            path = "/".join(self._strip_path_params(segment) for segment in path.split("/"))
+        if query and (self.strip_params or self.sort_params):
+            # left encoded exactly as they were, so the server gets the same bytes it handed out
+            pairs = [p for p in query.split("&") if p and not self._stripped(unquote_plus(p.split("=")[0]))]
+            query = "&".join(sorted(pairs) if self.sort_params else pairs)
+        if (path, query) == (parsed.path, parsed.query):
+            return url
+        return urlunsplit(parsed._replace(path=path, query=query))
+
+    def _strip_path_params(self, segment):
+        name, *params = segment.split(";")
+        return ";".join([name] + [p for p in params if not self._stripped(p.split("=")[0])])
+
+    def _stripped(self, name):
+        return bool(self.strip_params and self.strip_params.search(name))
+
+
+class TrapGuard:
+    """
+    Heuristics for spotting crawler traps - calendars that go on forever, relative links that keep nesting a path
+    inside itself, endless filter combinations - before they eat the crawl. A url is turned away if it's more than
+    max_depth directories deep, if any one path segment repeats more than max_repeats times, or if more than
+    pattern_budget urls of the same shape have already been let through. Anything left as None isn't checked.
+    """
+    def __init__(self, max_depth=None, max_repeats=None, pattern_budget=None):
+        self.max_depth = max_depth
+        self.max_repeats = max_repeats
+        self.pattern_budget = pattern_budget
+        self._patterns = Counter()
+        # urls we've turned away already (a trap tends to get linked over and over), and why
+        self._turned_away = {}
+        self.skipped = Counter()
+
+    # None if the url is fine to crawl, otherwise what's wrong with it. urls that pass count towards their pattern's budget
+    def check(self, url):
+        if url in self._turned_away:
+            return self._turned_away[url]
+        parsed = urlparse(url)
+        segments = [s for s in parsed.path.split("/") if s]
+        if self.max_depth is not None and len(segments) > self.max_depth:
+            return self._skip(url, "too deep")
+        if self.max_repeats is not None and segments and max(Counter(segments).values()) > self.max_repeats:
+            return self._skip(url, "repeating path")
+        if self.pattern_budget is not None:
+            pattern = self.pattern(parsed)
+            if self._patterns[pattern] >= self.pattern_budget:
+                return self._skip(url, "over budget")
+            self._patterns[pattern] += 1
+        return None
+
+    # the shape of a url: numbers become #, and only the names of query parameters count (e.g. /events/#/#?view)
+    @staticmethod
+    def pattern(parsed):
+        shape = re.sub(r"\d+", "#", f"{parsed.netloc.lower()}{parsed.path}")
+        names = sorted({k for k, _ in parse_qsl(parsed.query, keep_blank_values=True)})
+        return f"{shape}?{'&'.join(names)}" if names else shape
+
+    def _skip(self, url, reason):
+        self._turned_away[url] = reason
+        self.skipped[reason] += 1
+        return reason